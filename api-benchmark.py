@@ -0,0 +1,139 @@
+"""Cold start, idle memory and import cost of one API worker.
+
+Starts fresh interpreters that import api.py and run its startup against a throwaway data
+directory (as a non-maintenance worker, so no background file jobs run), then exits 1 if the
+median import time, startup time or idle RSS is over its limit, or if any of HEAVY_MODULES was
+imported before it was needed.
+
+    python api-benchmark.py [--runs 5] [--max-import 1.0] [--max-startup 1.5] [--max-rss 100]
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+# Only loaded when a request needs them (see lazy_imports.py)
+HEAVY_MODULES = ("google.cloud.bigquery", "google.oauth2.service_account", "pyarrow", "pandas")
+
+WORKER = """
+import asyncio, json, os, resource, sys, time
+started = time.perf_counter()
+import api
+imported = time.perf_counter()
+
+async def start_and_stop():
+    await api.startup()
+    ready = time.perf_counter()
+    await asyncio.sleep(0.5)
+    rss = None
+    try:
+        with open("/proc/self/status", encoding="utf-8") as fp:
+            rss = next(int(line.split()[1]) / 1024 for line in fp if line.startswith("VmRSS:"))
+    except OSError:
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1024 * 1024 if sys.platform == "darwin" else 1024)
+    loaded = [name for name in json.loads(os.environ["BENCHMARK_HEAVY_MODULES"]) if name in sys.modules]
+    await api.shutdown()
+    return ready, rss, loaded
+
+ready, rss, loaded = asyncio.run(start_and_stop())
+print("BENCHMARK " + json.dumps({"Import": imported - started, "Startup": ready - started,
+                                 "RssMb": rss, "Loaded": loaded}))
+"""
+
+DIRECTORIES = ("api/logs", "api/data", "main/train_arrivals/json/cta", "main/train_arrivals/csv/cta",
+               "main/train_arrivals/csv_month/cta", "main/sorting_information", "wmata/train_arrivals/json",
+               "transit")
+FILES = {"api/.tokens": {}, "api/.transit_data_tokens": {}, "api/data/articles.json": {},
+         "api/data/tesla.json": [], "main/sorting_information/sort_info.json": {},
+         "transit/amtrak.json": {}, "transit/transit-data.json": {}, "transit/transit_trips.json": {}}
+
+
+def make_environment(root):
+    """A minimal data tree and the .env values api.py needs to import against it"""
+    for directory in DIRECTORIES:
+        os.makedirs(os.path.join(root, directory), exist_ok=True)
+    for path, content in FILES.items():
+        with open(os.path.join(root, path), 'w', encoding="utf-8") as fp:
+            json.dump(content, fp)
+    environment = dict(os.environ)
+    environment.update(API_FILE_PATH=root + "/api/", FILE_PATH=root + "/main/", WMATA_FILE_PATH=root + "/wmata/",
+                       FILE_PATH_TRANSIT_DATA=root + "/transit/", API_AUTH_TOKEN="benchmark",
+                       GOOGLE_APPLICATION_CREDENTIALS="credentials.json", API_MAINTENANCE_WORKER="0",
+                       RATE_LIMIT_REDIS_URL=os.getenv("RATE_LIMIT_REDIS_URL", "redis://localhost"),
+                       BENCHMARK_HEAVY_MODULES=json.dumps(HEAVY_MODULES))
+    return environment
+
+
+def run_worker(environment, import_time=False):
+    command = [sys.executable] + (["-X", "importtime"] if import_time else []) + ["-c", WORKER]
+    result = subprocess.run(command, cwd=os.path.dirname(os.path.abspath(__file__)), env=environment,
+                            capture_output=True, text=True, check=False)
+    for line in result.stdout.splitlines():
+        if line.startswith("BENCHMARK "):
+            return json.loads(line[len("BENCHMARK "):]), result.stderr
+    raise RuntimeError(f"Worker failed:\n{result.stdout}\n{result.stderr}")
+
+
+def api_import_costs(importtime_output, top):
+    """The slowest modules api.py imports directly, as (cumulative seconds, name)"""
+    children, costs = [], []
+    for line in importtime_output.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip())) // 2
+        name = name.strip()
+        if depth == 0:
+            if name == "api":
+                costs = children
+            children = []
+        elif depth == 1:
+            children.append((int(cumulative) / 1e6, name))
+    return sorted(costs, reverse=True)[:top]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--max-import", type=float, default=1.0, help="seconds to import api.py")
+    parser.add_argument("--max-startup", type=float, default=1.5, help="seconds until startup has finished")
+    parser.add_argument("--max-rss", type=float, default=100, help="idle worker RSS in MB")
+    parser.add_argument("--top", type=int, default=10, help="slowest imports to list")
+    arguments = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as root:
+        environment = make_environment(root)
+        results = [run_worker(environment)[0] for _ in range(arguments.runs)]
+        _, importtime_output = run_worker(environment, import_time=True)
+
+    import_seconds = statistics.median(result["Import"] for result in results)
+    startup_seconds = statistics.median(result["Startup"] for result in results)
+    rss_mb = statistics.median(result["RssMb"] for result in results)
+    loaded = sorted({name for result in results for name in result["Loaded"]})
+    print(f"Import:  {import_seconds:.3f}s (limit {arguments.max_import}s)")
+    print(f"Startup: {startup_seconds:.3f}s (limit {arguments.max_startup}s)")
+    print(f"Idle RSS: {rss_mb:.1f} MB (limit {arguments.max_rss} MB)")
+    print("Slowest imports from api.py:")
+    for seconds, name in api_import_costs(importtime_output, arguments.top):
+        print(f"  {seconds:.3f}s  {name}")
+
+    failures = []
+    if import_seconds > arguments.max_import:
+        failures.append("import time")
+    if startup_seconds > arguments.max_startup:
+        failures.append("startup time")
+    if rss_mb > arguments.max_rss:
+        failures.append("idle memory")
+    if loaded:
+        failures.append(f"loaded at startup: {', '.join(loaded)}")
+    if failures:
+        print(f"FAILED: {'; '.join(failures)}")
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == '__main__':
+    main()
@@ -1,18 +1,241 @@
+import hashlib
+import importlib
+import os
+import select
+import signal
+import socket
 import sys
+import time
 import traceback
 import uvicorn
+from dotenv import load_dotenv
+
+HOST = "0.0.0.0"
+PORT = 9090
+# Libraries imported once in the supervisor so forked workers share their pages and start faster.
+# api.py and the repo's own modules are imported by each worker, so a reload picks up new code.
+# pyarrow is left out: workers import it lazily on first use (see lazy_imports.py), and preloading
+# it would add its memory and thread pools to every worker whether it is used or not.
+PRELOAD_MODULES = ("fastapi", "starlette", "pydantic", "dateutil", "redis.asyncio", "brotli", "zstandard",
+                   "uvloop", "httptools")
+# A reload re-forks from the supervisor's own imports, so when these change it re-executes instead
+RESTART_FILES = ("requirements.txt", os.path.basename(__file__))
+# Seconds before retrying a worker that failed to start, doubling up to the maximum
+RETRY_DELAY = 1
+RETRY_MAX_DELAY = 60
+
+
+def restart_signature():
+    digest = hashlib.sha256()
+    for filename in RESTART_FILES:
+        try:
+            with open(os.path.join(os.path.dirname(os.path.abspath(__file__)), filename), 'rb') as fp:
+                digest.update(fp.read())
+        except OSError:
+            pass
+    return digest.hexdigest()
+
+
+def server_config():
+    return uvicorn.Config(
+        "api:app",
+        host=HOST,
+        port=PORT,
+        loop="auto",  # uvloop and httptools when they are installed
+        http="auto",
+        proxy_headers=True,
+        forwarded_allow_ips='*',
+        timeout_graceful_shutdown=graceful_timeout
+    )
+
+
+class WorkerServer(uvicorn.Server):
+    """Tells the supervisor once the app has started so a reload only retires a worker after its
+    replacement is serving"""
+
+    def __init__(self, config, ready_fd):
+        super().__init__(config)
+        self.ready_fd = ready_fd
+
+    async def startup(self, sockets=None):
+        await super().startup(sockets=sockets)
+        if not self.should_exit:
+            os.write(self.ready_fd, b"1")
+        os.close(self.ready_fd)
+
+
+def run_worker(listener, slot, ready_fd):
+    for signal_number in (signal.SIGHUP, signal.SIGTERM, signal.SIGINT, signal.SIGCHLD):
+        signal.signal(signal_number, signal.SIG_DFL)
+    os.environ["API_WORKER_ID"] = str(slot)
+    # Only worker 0 runs the file maintenance jobs (precompression, Parquet compaction)
+    os.environ["API_MAINTENANCE_WORKER"] = "1" if slot == 0 else "0"
+    try:
+        WorkerServer(server_config(), ready_fd).run(sockets=[listener])
+    except Exception:  # pylint: disable=broad-except
+        traceback.print_exc(file=sys.stdout)
+        os._exit(1)
+    os._exit(0)
+
+
+class Supervisor:
+    """Forks workers that share one listening socket, replaces any that die (retrying with backoff
+    while a replacement fails to start), and on SIGHUP starts a new worker for each slot in turn,
+    retiring the old one (SIGTERM - it stops accepting and lets in-flight requests and streams
+    finish) only once the new one is ready. If requirements.txt or
+    this file changed since it started, SIGHUP instead stops the workers and sets restart, so the
+    caller can re-execute the supervisor with the new libraries."""
+
+    def __init__(self, workers):
+        self.workers = workers
+        self.listener = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.listener.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self.listener.bind((HOST, PORT))
+        self.listener.listen(2048)
+        self.listener.set_inheritable(True)
+        self.slots = {}
+        self.retries = {}
+        self.retiring = set()
+        self.reload_requested = False
+        self.stopping = False
+        self.restart = False
+        self.signature = restart_signature()
+
+    def spawn(self, slot):
+        """Starts a worker for slot and returns (pid, ready_fd)"""
+        ready_read, ready_write = os.pipe()
+        pid = os.fork()
+        if pid == 0:
+            os.close(ready_read)
+            run_worker(self.listener, slot, ready_write)
+        os.close(ready_write)
+        return pid, ready_read
+
+    def wait_ready(self, ready_fd, timeout=120):
+        try:
+            readable, _, _ = select.select([ready_fd], [], [], timeout)
+            return bool(readable) and os.read(ready_fd, 1) == b"1"
+        finally:
+            os.close(ready_fd)
+
+    def start_slot(self, slot):
+        pid, ready_fd = self.spawn(slot)
+        if self.wait_ready(ready_fd):
+            self.slots[slot] = pid
+            self.retries.pop(slot, None)
+            return True
+        print(f'Worker {slot} failed to start')
+        self.stop_pid(pid, signal.SIGKILL)
+        return False
+
+    def restart_slot(self, slot):
+        """start_slot, scheduling another attempt with backoff if it fails"""
+        if not self.start_slot(slot):
+            delay = min(self.retries[slot][1] * 2, RETRY_MAX_DELAY) if slot in self.retries else RETRY_DELAY
+            print(f'Retrying worker {slot} in {delay}s')
+            self.retries[slot] = (time.monotonic() + delay, delay)
+
+    def retry_slots(self):
+        for slot, (next_attempt, _) in list(self.retries.items()):
+            if slot not in self.slots and time.monotonic() >= next_attempt:
+                self.restart_slot(slot)
+
+    def stop_pid(self, pid, signal_number=signal.SIGTERM):
+        try:
+            os.kill(pid, signal_number)
+        except ProcessLookupError:
+            pass
+
+    def rolling_reload(self):
+        print('Reloading workers')
+        for slot in range(self.workers):
+            old_pid = self.slots.get(slot)
+            if not self.start_slot(slot):
+                print('Reload stopped, keeping the remaining workers')
+                if old_pid is not None:
+                    self.slots[slot] = old_pid
+                return
+            if old_pid is not None:
+                self.retiring.add(old_pid)
+                self.stop_pid(old_pid)
+
+    def reap(self):
+        while True:
+            try:
+                pid, _ = os.waitpid(-1, os.WNOHANG)
+            except ChildProcessError:
+                return
+            if pid == 0:
+                return
+            self.retiring.discard(pid)
+            for slot, slot_pid in list(self.slots.items()):
+                if slot_pid == pid:
+                    del self.slots[slot]
+                    if not self.stopping:
+                        print(f'Worker {slot} exited, restarting')
+                        self.restart_slot(slot)
+
+    def run(self):
+        signal.signal(signal.SIGHUP, self.on_reload)
+        signal.signal(signal.SIGTERM, self.on_stop)
+        signal.signal(signal.SIGINT, self.on_stop)
+        for slot in range(self.workers):
+            self.restart_slot(slot)
+        if not self.slots:
+            raise RuntimeError('No workers started')
+        while not self.stopping:
+            if self.reload_requested:
+                self.reload_requested = False
+                if restart_signature() != self.signature:
+                    print('Requirements changed, restarting')
+                    self.restart = self.stopping = True
+                    break
+                self.rolling_reload()
+            self.reap()
+            self.retry_slots()
+            time.sleep(0.5)
+        for pid in list(self.slots.values()) + list(self.retiring):
+            self.stop_pid(pid)
+        deadline = time.monotonic() + graceful_timeout + 5
+        while (self.slots or self.retiring) and time.monotonic() < deadline:
+            self.reap()
+            time.sleep(0.2)
+        for pid in list(self.slots.values()) + list(self.retiring):
+            self.stop_pid(pid, signal.SIGKILL)
+
+    def on_reload(self, *_):
+        self.reload_requested = True
+
+    def on_stop(self, *_):
+        self.stopping = True
+
+
+def preload():
+    for module in PRELOAD_MODULES:
+        try:
+            importlib.import_module(module)
+        except ImportError:
+            pass
+
 
 if __name__ == '__main__':
-    print('Starting API Server: 0.0.0.0:9090')
+    load_dotenv()
+    worker_count = int(os.getenv('API_WORKERS') or os.cpu_count() or 1)
+    graceful_timeout = int(os.getenv('API_GRACEFUL_TIMEOUT', '300'))
+    print(f'Starting API Server: {HOST}:{PORT} ({worker_count} workers)')
 
     try:
-        uvicorn.run(
-            "api:app",
-            host="0.0.0.0",
-            port="9090",
-            proxy_headers=True,
-            forwarded_allow_ips='*'
-        )
+        if hasattr(os, "fork"):
+            preload()
+            supervisor = Supervisor(worker_count)
+            supervisor.run()
+            if supervisor.restart:
+                supervisor.listener.close()
+                sys.stdout.flush()
+                os.execv(sys.executable, [sys.executable] + sys.argv)
+        else:
+            uvicorn.Server(server_config()).run()
+        print('Exiting')
     except KeyboardInterrupt:
         print('Exiting')
     except Exception as e:
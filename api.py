@@ -1,25 +1,43 @@
 """cta-reliability API by Brandon McFadden"""
 from datetime import datetime, timedelta
 from operator import index
+import asyncio
+import functools
 import os  # Used to retrieve secrets in .env file
 import time
 import json
 import logging
-from logging.handlers import RotatingFileHandler
+from logging.handlers import WatchedFileHandler
 import secrets
-import pandas as pd
 from dotenv import load_dotenv  # Used to Load Env Var
-from fastapi import FastAPI, HTTPException, Depends, status, Request, Response
+from fastapi import FastAPI, HTTPException, Depends, status, Request, Response, Query
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from fastapi.responses import HTMLResponse, StreamingResponse, RedirectResponse, JSONResponse, PlainTextResponse
 from fastapi.encoders import jsonable_encoder
-import redis.asyncio as redis
-from fastapi_limiter import FastAPILimiter
-from fastapi_limiter.depends import RateLimiter
-from google.cloud import bigquery
-from google.oauth2 import service_account
+from starlette.concurrency import run_in_threadpool
 from dateutil.relativedelta import relativedelta
 import apihtml
+from credential_store import CredentialStore
+from document_store import JsonDocument
+from file_serving import serve_json_file, serve_csv_file, serve_document
+from response_cache import FileCache
+import precompress
+from warehouse import WarehouseClient, BigQueryArrivalsBackend, make_arrivals_backend, encode_csv, PAGE_SIZE
+from arrivals_store import ParquetArrivalsStore, LocalFirstArrivalsBackend
+from arrivals_filter import ArrivalsFilter
+from query_cache import QueryResultCache
+from file_catalog import catalog, catalog_stats
+from trip_store import TripStore
+from station_registry import StationRegistry, MissingTicketType
+from trip_export import EXPORT_FORMATS
+from tesla_store import TeslaStore
+from articles_index import ArticlesIndex
+from rate_limiter import RateLimiter, rate_limits
+from quotas import Quotas, QuotaMiddleware, QUOTA_TIERS
+try:
+    import fcntl
+except ImportError:  # single process without fork, nothing to exclude
+    fcntl = None
 
 app = FastAPI(docs_url=None)
 security = HTTPBasic()
@@ -43,6 +61,40 @@ environment = os.getenv('ENVIRONMENT')
 cta_train_arrivals_table = os.getenv('CTA_PROCESSED_ARRIVALS')
 gcloud_project_id = os.getenv('GCLOUD_PROJECT_ID')
 google_credentials_file = main_file_path + os.getenv('GOOGLE_APPLICATION_CREDENTIALS')
+arrivals_store = ParquetArrivalsStore(main_file_path_csv + "cta/", main_file_path_csv_month + "cta/",
+                                      main_file_path + "train_arrivals/parquet/cta/")
+warehouse_client = WarehouseClient(google_credentials_file,
+                                   max_workers=int(os.getenv('WAREHOUSE_MAX_WORKERS', '4')))
+arrivals_backend = LocalFirstArrivalsBackend(
+    arrivals_store, make_arrivals_backend(os.getenv('ARRIVALS_BACKEND'), warehouse_client))
+query_cache = QueryResultCache(api_file_path + "query_cache/",
+                               max_bytes=int(os.getenv('QUERY_CACHE_BYTES', str(1024 * 1024 * 1024))),
+                               open_ttl=int(os.getenv('QUERY_CACHE_OPEN_TTL', '300')))
+
+credential_store = CredentialStore(api_file_path + '.tokens')
+quotas = Quotas(api_file_path + "data/quota_usage.db", credential_store,
+                default_tier=os.getenv('QUOTA_DEFAULT_TIER', 'standard'))
+app.add_middleware(QuotaMiddleware, quotas=quotas)
+transit_tokens_document = JsonDocument(api_file_path + '.transit_data_tokens')
+articles_document = JsonDocument(api_file_path + "data/articles.json")
+articles_index = ArticlesIndex(articles_document)
+amtrak_document = JsonDocument(main_file_path_transit_data + "amtrak.json")
+transit_data_document = JsonDocument(main_file_path_transit_data + "transit-data.json")
+sort_info_document = JsonDocument(main_file_path + "sorting_information/sort_info.json")
+trip_store = TripStore(main_file_path_transit_data + "transit_trips.db",
+                       json_path=main_file_path_transit_data + "transit_trips.json")
+tesla_store = TeslaStore(api_file_path + "data/tesla.db", json_path=api_file_path + "data/tesla.json")
+station_registry = StationRegistry(main_file_path_transit_data + "transit_stations.json")
+daily_results_cache = FileCache(
+    max_bytes=int(os.getenv('DAILY_RESULTS_CACHE_BYTES', str(64 * 1024 * 1024))))
+precompress_interval = int(os.getenv('PRECOMPRESS_INTERVAL', '3600'))
+parquet_compact_interval = int(os.getenv('PARQUET_COMPACT_INTERVAL', '3600'))
+max_trip_batch = int(os.getenv('MAX_TRIP_BATCH', '10000'))
+quota_flush_interval = float(os.getenv('QUOTA_FLUSH_INTERVAL', '1'))
+# Set to 0 by api-launch.py on all but one worker so file maintenance jobs run once per host
+maintenance_worker = os.getenv('API_MAINTENANCE_WORKER', '1') == '1'
+warehouse_preconnect = os.getenv('WAREHOUSE_PRECONNECT', '0') == '1'
+background_tasks = set()
 
 
 def get_date(date_type):
@@ -75,43 +127,10 @@ def get_date(date_type):
     return date
 
 
-def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
+def verify_credentials(credentials):
     """Used to verify Creds"""
-    file = open(file=api_file_path + '.tokens',
-                mode='r',
-                encoding='utf-8')
-    tokens = json.load(file)
-    try:
-        if credentials.username in tokens:
-            is_correct_username = True
-        else:
-            is_correct_username = False
-            reason = "Incorrect username or password"
-    except:  # pylint: disable=bare-except
-        is_correct_username = False
-        reason = "Incorrect username or password"
-
-    try:
-        if credentials.password == tokens[credentials.username]["password"]:
-            is_correct_password = True
-        else:
-            is_correct_password = False
-            reason = "Incorrect username or password"
-    except:  # pylint: disable=bare-except
-        is_correct_password = False
-        reason = "Incorrect username or password"
-
-    try:
-        if tokens[credentials.username]["disabled"] == "True":
-            is_enabled = False
-            reason = "Account Disabled"
-        else:
-            is_enabled = True
-    except:  # pylint: disable=bare-except
-        is_enabled = True
-        reason = "Account Disabled"
-
-    if not (is_correct_username and is_correct_password and is_enabled):
+    reason = credential_store.check(credentials.username, credentials.password)
+    if reason is not None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail=reason,
@@ -120,6 +139,67 @@ def get_current_username(credentials: HTTPBasicCredentials = Depends(security)):
     return credentials.username
 
 
+def get_current_username(request: Request, credentials: HTTPBasicCredentials = Depends(security)):
+    """Used to verify Creds on data endpoints - and to refuse users who have used up their daily quota"""
+    username = verify_credentials(credentials)
+    request.state.quota_user = username
+    quotas.check(username)
+    return username
+
+
+def get_current_username_unmetered(credentials: HTTPBasicCredentials = Depends(security)):
+    """Used to verify Creds on management endpoints (users, posting data, metrics), which neither
+    count against the daily quota nor are refused by it"""
+    return verify_credentials(credentials)
+
+
+async def serve_daily_results(request, json_file, date):
+    """Daily results from the LRU cache - anything before yesterday is finished and never revalidated"""
+    return await serve_json_file(request, json_file, cache=daily_results_cache,
+                                 immutable=date < get_date("api-yesterday"))
+
+
+async def list_available(directory, response, start, end, limit, offset):
+    """Availability listing from the file catalog, narrowed by from=/to= and paged by limit=/offset=.
+    The catalog may stat and re-list the directory, so it runs in the threadpool."""
+    total, files_available = await run_in_threadpool(catalog(directory).listing, start, end, limit, offset)
+    response.headers["X-Total-Count"] = str(total)
+    return files_available
+
+
+async def run_periodically(func, interval, *args):
+    """Runs a blocking maintenance job in the threadpool every interval seconds"""
+    while True:
+        try:
+            await run_in_threadpool(func, *args)
+        except Exception:  # pylint: disable=broad-except
+            logging.getLogger("uvicorn.error").exception("Background job %s failed", func.__name__)
+        await asyncio.sleep(interval)
+
+
+def host_exclusive(func):
+    """Wraps a file maintenance job so it is skipped while another process on the host is running one.
+    During a rolling reload the retiring worker 0 and its replacement both have the jobs scheduled."""
+    @functools.wraps(func)
+    def run(*args):
+        if fcntl is None:
+            return func(*args)
+        with open(api_file_path + ".maintenance.lock", 'a', encoding="utf-8") as lock_fp:
+            try:
+                fcntl.flock(lock_fp, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return None
+            return func(*args)
+    return run
+
+
+def start_background_job(func, interval, *args):
+    """Schedules run_periodically and keeps a reference so the task is not garbage collected"""
+    task = asyncio.create_task(run_periodically(func, interval, *args))
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+
+
 def generate_html_response_intro():
     """Used for Root Page"""
     html_content = apihtml.MAIN_PAGE
@@ -150,18 +230,42 @@ def generate_html_response_error(date, endpoint, current_time):
 @app.on_event("startup")
 async def startup():
     """Tells API to Prep redis for Rate Limit"""
-    redis_value = redis.from_url(
-        "redis://localhost", encoding="utf-8", decode_responses=True)
+    rate_limits.connect(os.getenv('RATE_LIMIT_REDIS_URL', 'redis://localhost'))
     # Logging Information
     logger = logging.getLogger("uvicorn.access")
+    # Every worker appends to one file and logrotate rotates it (api-service.logrotate) - a
+    # RotatingFileHandler per worker would have several processes rotating the same file
     log_filename = api_file_path + '/logs/api-service.log'
     logging.basicConfig(level=logging.INFO)
-    handler = RotatingFileHandler(log_filename, maxBytes=10e6, backupCount=10)
+    handler = WatchedFileHandler(log_filename)
     formatter = logging.Formatter(
         '%(asctime)s - %(name)s - %(levelname)s - %(message)s')
     handler.setFormatter(formatter)
     logger.addHandler(handler)
-    await FastAPILimiter.init(redis_value)
+    task = asyncio.create_task(rate_limits.run())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
+    if precompress_interval > 0 and maintenance_worker:
+        start_background_job(host_exclusive(precompress.precompress_arrivals), precompress_interval, main_file_path)
+    start_background_job(quotas.flush, quota_flush_interval)
+    if parquet_compact_interval > 0 and arrivals_store.enabled and maintenance_worker:
+        start_background_job(host_exclusive(arrivals_store.compact), parquet_compact_interval)
+    if isinstance(arrivals_backend.remote, BigQueryArrivalsBackend):
+        # The client (and the Google libraries) load on the first warehouse query unless preconnect is set
+        if warehouse_preconnect:
+            try:
+                await warehouse_client.run(warehouse_client.client, label="connect")
+            except Exception:  # pylint: disable=broad-except
+                logging.getLogger("uvicorn.error").exception("Unable to create the BigQuery client, retrying on first query")
+        start_background_job(warehouse_client.refresh_credentials, 60)
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Stops the warehouse executor and flushes rate limit counts"""
+    warehouse_client.shutdown()
+    await rate_limits.close()
+    quotas.flush()
 
 
 @app.get("/", dependencies=[Depends(RateLimiter(times=2, seconds=1))], response_class=RedirectResponse, status_code=302)
@@ -176,143 +280,139 @@ async def documentation():
     return "https://brandonmcfadden.com/transit-api"
 
 
+@app.get("/api/metrics", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
+async def get_metrics(token: str = Depends(get_current_username_unmetered)):
+    """Used to retrieve cache and latency counters"""
+    return {"DateTime": get_date("code-time"),
+            "Auth": credential_store.stats(),
+            "DailyResultsCache": daily_results_cache.stats(),
+            "Precompress": dict(precompress.stats),
+            "ArrivalsStore": {"Partitions": len(arrivals_store.available_dates()),
+                              **arrivals_store.stats, **arrivals_backend.stats},
+            "Warehouse": warehouse_client.stats(),
+            "QueryCache": query_cache.stats(),
+            "FileCatalog": catalog_stats(),
+            "StationRegistry": station_registry.stats(),
+            "ArticlesIndex": articles_index.stats(),
+            "RateLimits": rate_limits.stats(),
+            "Quotas": quotas.stats(),
+            "Documents": {"Articles": articles_document.stats(), "Amtrak": amtrak_document.stats(),
+                          "TransitData": transit_data_document.stats(),
+                          "TransitTokens": transit_tokens_document.stats(),
+                          "SortInfo": sort_info_document.stats()}}
+
+
 @app.get("/api/v1/get_daily_results/{date}", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_results_for_date(date: str, token: str = Depends(get_current_username)):
+async def return_results_for_date(request: Request, date: str, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     try:
         json_file = main_file_path_json + "cta/" + date + ".json"
-        results = open(json_file, 'r', encoding="utf-8")
-        return Response(content=results.read(), media_type="application/json")
+        return await serve_daily_results(request, json_file, date)
     except:  # pylint: disable=bare-except
         endpoint = "https://brandonmcfadden.com/api/v1/get_daily_results/"
         return generate_html_response_error(date, endpoint, get_date("current"))
 
 
 @app.get("/api/v2/cta/get_daily_results/{date}", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_results_for_date_cta_v2(date: str, token: str = Depends(get_current_username)):
+async def return_results_for_date_cta_v2(request: Request, response: Response, date: str, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"), limit: int = None, offset: int = 0, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     if date == "today":
         date = get_date("api-today")
     elif date == "yesterday":
         date = get_date("api-yesterday")
     if date == "availability":
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_json + "cta/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_json + "cta/", response, start, end, limit, offset)
     else:
         try:
             json_file = main_file_path_json + "cta/" + date + ".json"
-            results = open(json_file, 'r', encoding="utf-8")
-            return Response(content=results.read(), media_type="application/json")
+            return await serve_daily_results(request, json_file, date)
         except:  # pylint: disable=bare-except
             endpoint = "https://brandonmcfadden.com/api/v2/cta/get_daily_results/"
             return generate_html_response_error(date, endpoint, get_date("current"))
 
 
 @app.get("/api/v2/metra/get_daily_results/{date}", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_results_for_date_metra_v2(date: str, token: str = Depends(get_current_username)):
+async def return_results_for_date_metra_v2(request: Request, response: Response, date: str, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"), limit: int = None, offset: int = 0, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     if date == "today":
         date = get_date("api-today")
     elif date == "yesterday":
         date = get_date("api-yesterday")
     if date == "availability":
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_json + "metra/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_json + "metra/", response, start, end, limit, offset)
     else:
         try:
             json_file = main_file_path_json + "metra/" + date + ".json"
-            results = open(json_file, 'r', encoding="utf-8")
-            return Response(content=results.read(), media_type="application/json")
+            return await serve_daily_results(request, json_file, date)
         except:  # pylint: disable=bare-except
             endpoint = "https://brandonmcfadden.com/api/v2/metra/get_daily_results/"
             return generate_html_response_error(date, endpoint, get_date("current"))
 
 
 @app.get("/api/v2/cta/get_train_arrivals_by_day/{date}", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_arrivals_for_date_cta_v2(date: str, token: str = Depends(get_current_username)):
+async def return_arrivals_for_date_cta_v2(request: Request, response: Response, date: str, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"), limit: int = None, offset: int = 0, columns: str = None, line: str = None, station: str = None, start_time: str = None, end_time: str = None, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     if date == "yesterday":
         date = get_date("api-yesterday")
     if date == "availability":
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_csv + "cta/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_csv + "cta/", response, start, end, limit, offset)
     else:
         try:
             csv_file = main_file_path_csv + "cta/" + date + ".csv"
-            results = open(csv_file, 'r', encoding="utf-8")
-            return StreamingResponse(
-                results,
-                media_type="text/csv",
-                headers={
-                    "Content-Disposition": f"attachment; filename=cta-arrivals-{date}.csv"}
-            )
+            return await serve_csv_file(request, csv_file, f"cta-arrivals-{date}.csv",
+                                        ArrivalsFilter(columns, line, station, start_time, end_time))
         except:  # pylint: disable=bare-except
             endpoint = "https://brandonmcfadden.com/api/v2/cta/get_train_arrivals_by_day/"
             return generate_html_response_error(date, endpoint, get_date("current"))
 
 
 @app.get("/api/v2/cta/get_train_arrivals_by_month/{date}", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_arrivals_for_date_month_cta_v2(date: str, token: str = Depends(get_current_username)):
+async def return_arrivals_for_date_month_cta_v2(request: Request, response: Response, date: str, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"), limit: int = None, offset: int = 0, columns: str = None, line: str = None, station: str = None, start_time: str = None, end_time: str = None, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     if date == "yesterday":
         date = get_date("api-last-month")
     if date == "availability":
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_csv_month + "cta/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_csv_month + "cta/", response, start, end, limit, offset)
     else:
         try:
             csv_file = main_file_path_csv_month + "cta/" + date + ".csv"
-            results = open(csv_file, 'r', encoding="utf-8")
-            return StreamingResponse(
-                results,
-                media_type="text/csv",
-                headers={
-                    "Content-Disposition": f"attachment; filename=cta-arrivals-{date}.csv"}
-            )
+            return await serve_csv_file(request, csv_file, f"cta-arrivals-{date}.csv",
+                                        ArrivalsFilter(columns, line, station, start_time, end_time))
         except:  # pylint: disable=bare-except
             endpoint = "https://brandonmcfadden.com/api/v2/cta/get_train_arrivals_by_day/"
             return generate_html_response_error(date, endpoint, get_date("current"))
 
 
 @app.get("/api/sorting_information/get", dependencies=[Depends(RateLimiter(times=2, seconds=1))], status_code=200)
-async def get_sort_information(token: str = Depends(get_current_username)):
+async def get_sort_information(request: Request, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     try:
-        json_file = main_file_path + "sorting_information/sort_info.json"
-        results = open(json_file, 'r', encoding="utf-8")
-        return Response(content=results.read(), media_type="application/json")
+        return await serve_document(request, sort_info_document)
     except:  # pylint: disable=bare-except
         endpoint = "https://brandonmcfadden.com/api/sorting_information/get"
         return generate_html_response_error(get_date("current"), endpoint, get_date("current"))
 
 
 @app.get("/api/v2/wmata/get_daily_results/{date}", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_results_for_date_wmata_v2(date: str, token: str = Depends(get_current_username)):
+async def return_results_for_date_wmata_v2(request: Request, response: Response, date: str, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"), limit: int = None, offset: int = 0, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     if date == "today":
         date = get_date("api-today-est")
     elif date == "yesterday":
         date = get_date("api-yesterday-est")
     if date == "availability":
-        files_available = sorted((f for f in os.listdir(
-            wmata_main_file_path_json) if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(wmata_main_file_path_json, response, start, end, limit, offset)
     else:
         try:
             json_file = wmata_main_file_path_json + date + ".json"
-            results = open(json_file, 'r', encoding="utf-8")
-            return Response(content=results.read(), media_type="application/json")
+            return await serve_daily_results(request, json_file, date)
         except:  # pylint: disable=bare-except
             endpoint = "https://brandonmcfadden.com/api/v2/wmata/get_daily_results/"
             return generate_html_response_error(date, endpoint, get_date("current"))
 
 
 @app.get("/api/transit/get_daily_results/", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_results_for_date_transit(agency: str, date: str = None, availability: bool = False, token: str = Depends(get_current_username)):
+async def return_results_for_date_transit(request: Request, response: Response, agency: str, date: str = None, availability: bool = False, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"), limit: int = None, offset: int = 0, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     if date == "today" and (agency == 'cta' or agency == 'metra'):
         date = get_date("api-today")
@@ -323,31 +423,22 @@ async def return_results_for_date_transit(agency: str, date: str = None, availab
     elif date == "yesterday" and agency == "wmata":
         date = get_date("api-yesterday-est")
     if availability is True and agency == 'cta':
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_json + "cta/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_json + "cta/", response, start, end, limit, offset)
     elif availability is True and agency == "wmata":
-        files_available = sorted((f for f in os.listdir(
-            wmata_main_file_path_json) if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(wmata_main_file_path_json, response, start, end, limit, offset)
     elif availability is True and agency == 'metra':
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_json + "metra/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_json + "metra/", response, start, end, limit, offset)
     else:
         try:
             if agency == 'cta':
                 json_file = main_file_path_json + "cta/" + date + ".json"
-                results = open(json_file, 'r', encoding="utf-8")
-                return Response(content=results.read(), media_type="application/json")
+                return await serve_daily_results(request, json_file, date)
             if agency == 'metra':
                 json_file = main_file_path_json + "metra/" + date + ".json"
-                results = open(json_file, 'r', encoding="utf-8")
-                return Response(content=results.read(), media_type="application/json")
+                return await serve_daily_results(request, json_file, date)
             elif agency == "wmata":
                 json_file = wmata_main_file_path_json + date + ".json"
-                results = open(json_file, 'r', encoding="utf-8")
-                return Response(content=results.read(), media_type="application/json")
+                return await serve_daily_results(request, json_file, date)
             else:
                 endpoint = "https://brandonmcfadden.com/api/transit/get_daily_results/"
                 return generate_html_response_error(date, endpoint, get_date("current"))
@@ -357,7 +448,7 @@ async def return_results_for_date_transit(agency: str, date: str = None, availab
 
 
 @app.get("/api/transit/get_train_arrivals_by_day/", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_arrivals_for_date(agency: str, date: str = None, availability: bool = False, token: str = Depends(get_current_username)):
+async def return_arrivals_for_date(request: Request, response: Response, agency: str, date: str = None, availability: bool = False, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"), limit: int = None, offset: int = 0, columns: str = None, line: str = None, station: str = None, start_time: str = None, end_time: str = None, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     if date == "today" and (agency == 'cta' or agency == 'metra'):
         date = get_date("api-today")
@@ -370,33 +461,19 @@ async def return_arrivals_for_date(agency: str, date: str = None, availability:
     if availability is True and agency == "wmata":
         return "Unavailable"
     elif availability is True and agency == 'cta':
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_csv + "cta/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_csv + "cta/", response, start, end, limit, offset)
     elif availability is True and agency == 'metra':
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_csv + "metra/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_csv + "metra/", response, start, end, limit, offset)
     else:
         try:
             if agency == 'cta':
                 csv_file = main_file_path_csv + "cta/" + date + ".csv"
-                results = open(csv_file, 'r', encoding="utf-8")
-                return StreamingResponse(
-                    results,
-                    media_type="text/csv",
-                    headers={
-                        "Content-Disposition": f"attachment; filename=cta-arrivals-{date}.csv"}
-                )
+                return await serve_csv_file(request, csv_file, f"cta-arrivals-{date}.csv",
+                                            ArrivalsFilter(columns, line, station, start_time, end_time))
             if agency == 'metra':
                 csv_file = main_file_path_csv + "metra/" + date + ".csv"
-                results = open(csv_file, 'r', encoding="utf-8")
-                return StreamingResponse(
-                    results,
-                    media_type="text/csv",
-                    headers={
-                        "Content-Disposition": f"attachment; filename=cta-arrivals-{date}.csv"}
-                )
+                return await serve_csv_file(request, csv_file, f"cta-arrivals-{date}.csv",
+                                            ArrivalsFilter(columns, line, station, start_time, end_time))
             elif agency == "wmata":
                 return "Unavailable"
             else:
@@ -408,7 +485,7 @@ async def return_arrivals_for_date(agency: str, date: str = None, availability:
 
 
 @app.get("/api/transit/get_train_arrivals/", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_arrivals_for_dates(agency: str, startdate: str, enddate: str = None, token: str = Depends(get_current_username)):
+async def return_arrivals_for_dates(request: Request, agency: str, startdate: str, enddate: str = None, columns: str = None, line: str = None, station: str = None, start_time: str = None, end_time: str = None, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     if agency == "wmata" or agency == 'metra':
         return "Unavailable"
@@ -416,34 +493,46 @@ async def return_arrivals_for_dates(agency: str, startdate: str, enddate: str =
         enddate = get_date("api-today")
     try:
         if agency == 'cta':
-            credentials = service_account.Credentials.from_service_account_file(
-            google_credentials_file, scopes=[
-                "https://www.googleapis.com/auth/cloud-platform"],
-            )
-
-            client = bigquery.Client(credentials=credentials,
-                                project=credentials.project_id,)
-            query_job = client.query(f"""
-            SELECT * FROM `cta-utilities-410023.cta.processed_arrivals` 
-            WHERE Arrival_Time >= '{startdate}' AND Arrival_Time < '{enddate}'
-            ORDER BY Arrival_Time ASC""")
-            results = query_job.to_dataframe(create_bqstorage_client=False) # Wait for the job to complete.
-            return StreamingResponse(
-                results.to_csv(index=False),
+            arrivals_filter = ArrivalsFilter(columns, line, station, start_time, end_time)
+            filename = f"cta-arrivals-{startdate}-{enddate}.csv"
+            cache_key = query_cache.make_key(agency, startdate, enddate, arrivals_filter)
+            is_closed = query_cache.is_closed(enddate, get_date("api-yesterday"))
+            cached_file = await query_cache.lookup(cache_key, is_closed)
+            if cached_file is None and await query_cache.wait_for(cache_key):
+                cached_file = await query_cache.lookup(cache_key, is_closed)
+            if cached_file is not None:
+                return await serve_csv_file(request, cached_file, filename)
+            # A cache miss costs the user one query unit per day the query covers
+            # (enddate is exclusive, and either bound may carry a time)
+            query_days = max((datetime.fromisoformat(enddate[:10]) - datetime.fromisoformat(startdate[:10])).days, 1)
+            quotas.charge_queries(token, query_days)
+            inflight = query_cache.begin(cache_key)
+            try:
+                header, pages = await warehouse_client.run(
+                    arrivals_backend.query, startdate, enddate, PAGE_SIZE, arrivals_filter)
+            except:  # pylint: disable=bare-except
+                query_cache.finish(cache_key, False, inflight)
+                quotas.charge_queries(token, -query_days)
+                raise
+            return query_cache.response(
+                cache_key, is_closed, inflight, warehouse_client.stream(encode_csv(header, pages)),
+                on_failure=lambda: quotas.charge_queries(token, -query_days),
                 media_type="text/csv",
                 headers={
-                    "Content-Disposition": f"attachment; filename=cta-arrivals-{startdate}-{enddate}.csv"}
+                    "Content-Disposition": f"attachment; filename={filename}"}
             )
         else:
             endpoint = "https://brandonmcfadden.com/api/transit/get_train_arrivals/"
             return generate_html_response_error(get_date("current"), endpoint, get_date("current"))
+    except HTTPException:
+        raise
     except:  # pylint: disable=bare-except
         endpoint = "https://brandonmcfadden.com/api/transit/get_train_arrivals/"
         return generate_html_response_error(get_date("current"), endpoint, get_date("current"))
 
 
 @app.get("/api/transit/get_train_arrivals_by_month/", dependencies=[Depends(RateLimiter(times=2, seconds=1))])
-async def return_arrivals_for_date_month(agency: str, date: str = None, availability: bool = False, token: str = Depends(get_current_username)):
+async def return_arrivals_for_date_month(request: Request, response: Response, agency: str, date: str = None, availability: bool = False, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"), limit: int = None, offset: int = 0, columns: str = None, line: str = None, station: str = None, start_time: str = None, end_time: str = None, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     if date == "today" and (agency == 'cta' or agency == 'metra'):
         date = get_date("api-today")
@@ -456,33 +545,19 @@ async def return_arrivals_for_date_month(agency: str, date: str = None, availabi
     if availability is True and agency == "wmata":
         return "Unavailable"
     elif availability is True and agency == 'cta':
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_csv_month + "cta/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_csv_month + "cta/", response, start, end, limit, offset)
     elif availability is True and agency == 'metra':
-        files_available = sorted((f for f in os.listdir(
-            main_file_path_csv_month + "metra/") if not f.startswith(".")), key=str.lower)
-        return files_available
+        return await list_available(main_file_path_csv_month + "metra/", response, start, end, limit, offset)
     else:
         try:
             if agency == 'cta':
                 csv_file = main_file_path_csv_month + "cta/" + date + ".csv"
-                results = open(csv_file, 'r', encoding="utf-8")
-                return StreamingResponse(
-                    results,
-                    media_type="text/csv",
-                    headers={
-                        "Content-Disposition": f"attachment; filename=cta-arrivals-{date}.csv"}
-                )
+                return await serve_csv_file(request, csv_file, f"cta-arrivals-{date}.csv",
+                                            ArrivalsFilter(columns, line, station, start_time, end_time))
             if agency == 'metra':
                 csv_file = main_file_path_csv_month + "metra/" + date + ".csv"
-                results = open(csv_file, 'r', encoding="utf-8")
-                return StreamingResponse(
-                    results,
-                    media_type="text/csv",
-                    headers={
-                        "Content-Disposition": f"attachment; filename=cta-arrivals-{date}.csv"}
-                )
+                return await serve_csv_file(request, csv_file, f"cta-arrivals-{date}.csv",
+                                            ArrivalsFilter(columns, line, station, start_time, end_time))
             elif agency == "wmata":
                 return "Unavailable"
             else:
@@ -494,40 +569,41 @@ async def return_arrivals_for_date_month(agency: str, date: str = None, availabi
 
 
 @app.post("/api/user_management", dependencies=[Depends(RateLimiter(times=2, seconds=1))], status_code=200)
-async def add_user_to_api(type: str, username: str, auth_token: str, token: str = Depends(get_current_username)):
-    """Used to retrieve results"""
+async def add_user_to_api(type: str, username: str, auth_token: str, tier: str = None, token: str = Depends(get_current_username_unmetered)):
+    """Used to retrieve results - type=add also sets the user's quota tier when tier= is given"""
+    if tier is not None and tier not in QUOTA_TIERS:
+        raise HTTPException(status_code=400, detail="Unknown Quota Tier")
     try:
         if auth_token == api_auth_token:
-            json_file = api_file_path + ".tokens"
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
-            if type == "add":
-                password = secrets.token_urlsafe(32)
-                input_data = {"password": password, "disabled": "False"}
-                return_text = {"DateTime": get_date(
-                    "code-time"), "Status": "", "Username": "", "Password": "", "Disabled": ""}
-                if username in json_file_loaded:
-                    return_text["Username"] = username
-                    return_text["Status"] = "Exists"
-                    return_text["Password"] = json_file_loaded[username]["password"]
-                    return_text["Disabled"] = json_file_loaded[username]["disabled"]
-                    json_file_loaded[username]["disabled"] = "False"
-                else:
-                    return_text["Username"] = username
-                    return_text["Password"] = password
-                    return_text["Disabled"] = "False"
-                    return_text["Status"] = "Added"
-                    json_file_loaded[username] = input_data
-            elif type == "remove":
-                if username in json_file_loaded:
-                    json_file_loaded.pop(username, None)
-                else:
-                    return {"username": username, "Status": "Failed to Remove User. User Does Not Exist."}
-                return_text = {"username": username, "Status": "Removed User."}
-            with open(json_file, 'w', encoding="utf-8") as fp2:
-                json.dump(json_file_loaded, fp2, indent=4,
-                          separators=(',', ': '))
-            return return_text
+            def change_user(json_file_loaded):
+                if type == "add":
+                    password = secrets.token_urlsafe(32)
+                    input_data = {"password": password, "disabled": "False"}
+                    return_text = {"DateTime": get_date(
+                        "code-time"), "Status": "", "Username": "", "Password": "", "Disabled": "", "Tier": ""}
+                    if username in json_file_loaded:
+                        return_text["Username"] = username
+                        return_text["Status"] = "Exists"
+                        return_text["Password"] = json_file_loaded[username]["password"]
+                        return_text["Disabled"] = json_file_loaded[username]["disabled"]
+                        json_file_loaded[username]["disabled"] = "False"
+                    else:
+                        return_text["Username"] = username
+                        return_text["Password"] = password
+                        return_text["Disabled"] = "False"
+                        return_text["Status"] = "Added"
+                        json_file_loaded[username] = input_data
+                    if tier is not None:
+                        json_file_loaded[username]["tier"] = tier
+                    return_text["Tier"] = json_file_loaded[username].get("tier", quotas.default_tier)
+                elif type == "remove":
+                    if username in json_file_loaded:
+                        json_file_loaded.pop(username, None)
+                    else:
+                        return {"username": username, "Status": "Failed to Remove User. User Does Not Exist."}
+                    return_text = {"username": username, "Status": "Removed User."}
+                return return_text
+            return await run_in_threadpool(credential_store.document.update, change_user)
         else:
             endpoint = "https://brandonmcfadden.com/api/add_user"
             return generate_html_response_error(get_date("current"), endpoint, get_date("current"))
@@ -537,41 +613,38 @@ async def add_user_to_api(type: str, username: str, auth_token: str, token: str
 
 
 @app.post("/api/amtrak/post", dependencies=[Depends(RateLimiter(times=2, seconds=1))], status_code=200)
-async def amtrak_trips(response: Response, auth_token: str, type: str, date: str, train: str, origin: str = None, destination: str = None, service: str = None, token: str = Depends(get_current_username)):
+async def amtrak_trips(response: Response, auth_token: str, type: str, date: str, train: str, origin: str = None, destination: str = None, service: str = None, token: str = Depends(get_current_username_unmetered)):
     """Used to retrieve results"""
     try:
         if auth_token == api_auth_token:
-            json_file = main_file_path_transit_data + "amtrak.json"
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
             train_id = f"{date}-{train}"
-            if type == "add":
-                if train_id in json_file_loaded:
-                    return_text = {"Status": "Train Already Present",
-                                   "TrainDetails": json_file_loaded[train_id]}
-                    response.status_code = status.HTTP_208_ALREADY_REPORTED
-                else:
-                    train_input = {"Date": date, "Train": train, "Origin": origin.upper(
-                    ), "Destination": destination.upper(), "Service": service.capitalize()}
-                    json_file_loaded[train_id] = train_input
-                    return_text = {"Status": "Train Added",
-                                   "TrainDetails": train_input}
-                    response.status_code = status.HTTP_201_CREATED
-            elif type == "remove":
-                if train_id in json_file_loaded:
-                    train_input = json_file_loaded[train_id]
-                    json_file_loaded.pop(train_id, None)
-                    return_text = {"Status": "Train Removed",
-                                   "TrainDetails": train_input}
-                    response.status_code = status.HTTP_202_ACCEPTED
-                else:
-                    return_text = {
-                        "Status": "Failed to Remove Train. Train does not exist.", "TrainID": train_id}
-                    response.status_code = status.HTTP_404_NOT_FOUND
-            with open(json_file, 'w', encoding="utf-8") as fp2:
-                json.dump(json_file_loaded, fp2, indent=4,
-                          separators=(',', ': '))
-            return return_text
+
+            def change_train(json_file_loaded):
+                if type == "add":
+                    if train_id in json_file_loaded:
+                        return_text = {"Status": "Train Already Present",
+                                       "TrainDetails": json_file_loaded[train_id]}
+                        response.status_code = status.HTTP_208_ALREADY_REPORTED
+                    else:
+                        train_input = {"Date": date, "Train": train, "Origin": origin.upper(
+                        ), "Destination": destination.upper(), "Service": service.capitalize()}
+                        json_file_loaded[train_id] = train_input
+                        return_text = {"Status": "Train Added",
+                                       "TrainDetails": train_input}
+                        response.status_code = status.HTTP_201_CREATED
+                elif type == "remove":
+                    if train_id in json_file_loaded:
+                        train_input = json_file_loaded[train_id]
+                        json_file_loaded.pop(train_id, None)
+                        return_text = {"Status": "Train Removed",
+                                       "TrainDetails": train_input}
+                        response.status_code = status.HTTP_202_ACCEPTED
+                    else:
+                        return_text = {
+                            "Status": "Failed to Remove Train. Train does not exist.", "TrainID": train_id}
+                        response.status_code = status.HTTP_404_NOT_FOUND
+                return return_text
+            return await run_in_threadpool(amtrak_document.update, change_train)
         else:
             endpoint = "https://brandonmcfadden.com/api/amtrak/post/"
             return generate_html_response_error(get_date("current"), endpoint, get_date("current"))
@@ -581,49 +654,40 @@ async def amtrak_trips(response: Response, auth_token: str, type: str, date: str
 
 
 @app.get("/api/amtrak/get", dependencies=[Depends(RateLimiter(times=2, seconds=1))], status_code=200)
-async def get_amtrak_trips(token: str = Depends(get_current_username)):
+async def get_amtrak_trips(request: Request, token: str = Depends(get_current_username)):
     """Used to retrieve results"""
     try:
-        json_file = main_file_path_transit_data + "amtrak.json"
-        results = open(json_file, 'r', encoding="utf-8")
-        return Response(content=results.read(), media_type="application/json")
+        return await serve_document(request, amtrak_document)
     except:  # pylint: disable=bare-except
         endpoint = "https://brandonmcfadden.com/api/amtrak/get/"
         return generate_html_response_error(get_date("current"), endpoint, get_date("current"))
 
 
 @app.get("/api/transit-data/get", status_code=200)
-async def get_transit_trips():
+async def get_transit_trips(request: Request):
     """Used to retrieve results"""
     try:
-        json_file = main_file_path_transit_data + "transit-data.json"
-        results = open(json_file, 'r', encoding="utf-8")
-        return Response(content=results.read(), media_type="application/json")
+        return await serve_document(request, transit_data_document)
     except:  # pylint: disable=bare-except
         endpoint = "https://brandonmcfadden.com/api/transit-data/get/"
         return generate_html_response_error(get_date("current"), endpoint, get_date("current"))
 
 
 @app.post("/api/transit-data/post", status_code=200)
-async def transit_trips(request: Request, response: Response, auth_token: str, year: str, token: str = Depends(get_current_username)):
+async def transit_trips(request: Request, response: Response, auth_token: str, year: str, token: str = Depends(get_current_username_unmetered)):
     """Used to retrieve results"""
     try:
         if auth_token == api_auth_token:
-            json_file = main_file_path_transit_data + "transit-data.json"
             request_body_input = await request.json()
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
-            if year in json_file_loaded:
-                json_file_loaded[year] = request_body_input
-                response.status_code = status.HTTP_202_ACCEPTED
-            else:
+
+            def set_year(json_file_loaded):
+                if year in json_file_loaded:
+                    response.status_code = status.HTTP_202_ACCEPTED
+                else:
+                    response.status_code = status.HTTP_201_CREATED
                 json_file_loaded[year] = request_body_input
-                response.status_code = status.HTTP_201_CREATED
-            with open(json_file, 'w', encoding="utf-8") as fp2:
-                json.dump(json_file_loaded, fp2, indent=4,
-                          separators=(',', ': '))
-            results = open(json_file, 'r', encoding="utf-8")
-            return Response(content=results.read(), media_type="application/json")
+            await run_in_threadpool(transit_data_document.update, set_year)
+            return await serve_document(request, transit_data_document, status_code=response.status_code)
         else:
             raise HTTPException(
                 status_code=401, detail="Auth Token not Provided")
@@ -642,107 +706,34 @@ async def transit_tracker_trips(request: Request, response: Response, user: str,
                 request_input = request_input['data']
             elif 'body' in request_input:
                 request_input = request_input['body']
-            json_file = main_file_path_transit_data + "transit_trips.json"
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
             train_id = f"{request_input['Date']}-{request_input['Route']}-{request_input['Run Number']}"
             username = user.upper()
-            if username in json_file_loaded:
-                if agency not in json_file_loaded[username]:
-                    json_file_loaded[username][agency] = {}
+            if await run_in_threadpool(trip_store.has_user, username):
+                await run_in_threadpool(trip_store.add_agency, username, agency)
                 if type == "add":
-                    if train_id in json_file_loaded[username][agency]:
+                    existing_trip = await run_in_threadpool(trip_store.get_trip, username, agency, train_id)
+                    if existing_trip is not None:
                         return_text = {"Status": "Train Already Present",
-                                    "TrainDetails": json_file_loaded[username][agency][train_id]}
+                                    "TrainDetails": existing_trip}
                         response.status_code = status.HTTP_208_ALREADY_REPORTED
                     else:
-                        loop_routes = ['Brown', 'Orange', 'Pink', 'Purple']
-                        loop_stations = ['Clark/Lake', 'State/Lake', 'Washington/Wabash', 'Adams/Wabash',
-                                        'Harold Washington Library', 'LaSalle/Van Buren', 'Quincy', 'Washington/Wells']
-                        transit_stations_file_path = main_file_path_transit_data + \
-                            "transit_stations.json"
-                        with open(transit_stations_file_path, 'r', encoding="utf-8") as fp2:
-                            transit_stations = json.load(fp2)
-                        if request_input['Route'] in loop_routes and request_input['Origin'] in loop_stations:
-                            request_input['Origin Station - Mileage'] = transit_stations[agency][request_input['Route']
-                                                                                                ][request_input['Origin']]['Outbound']['Miles']
-                            request_input['Origin Station - Kilometers'] = transit_stations[agency][request_input['Route']
-                                                                                                    ][request_input['Origin']]['Outbound']['Kilometers']
-                            request_input['Destination Station - Mileage'] = transit_stations[agency][request_input['Route']
-                                                                                                    ][request_input['Destination']]['Outbound']['Miles']
-                            request_input['Destination Station - Kilometers'] = transit_stations[agency][request_input['Route']
-                                                                                                        ][request_input['Destination']]['Outbound']['Kilometers']
-                        elif request_input['Route'] in loop_routes and request_input['Origin'] not in loop_stations:
-                            request_input['Origin Station - Mileage'] = transit_stations[agency][request_input['Route']
-                                                                                                ][request_input['Origin']]['Inbound']['Miles']
-                            request_input['Origin Station - Kilometers'] = transit_stations[agency][request_input['Route']
-                                                                                                    ][request_input['Origin']]['Inbound']['Kilometers']
-                            request_input['Destination Station - Mileage'] = transit_stations[agency][request_input['Route']
-                                                                                                    ][request_input['Destination']]['Inbound']['Miles']
-                            request_input['Destination Station - Kilometers'] = transit_stations[agency][request_input['Route']
-                                                                                                        ][request_input['Destination']]['Inbound']['Kilometers']
+                        try:
+                            await run_in_threadpool(station_registry.enrich, agency, request_input)
+                        except MissingTicketType as exc:
+                            raise HTTPException(
+                                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=str(exc)) from exc
+                        if await run_in_threadpool(trip_store.add_trip, username, agency, train_id, request_input):
+                            return_text = {"Status": "Train Added",
+                                        "Username": username,
+                                        "TrainDetails": request_input}
+                            response.status_code = status.HTTP_201_CREATED
                         else:
-                            request_input['Origin Station - Mileage'] = transit_stations[agency][request_input['Route']
-                                                                                                ][request_input['Origin']]['Miles']
-                            request_input['Origin Station - Kilometers'] = transit_stations[agency][request_input['Route']
-                                                                                                    ][request_input['Origin']]['Kilometers']
-                            request_input['Destination Station - Mileage'] = transit_stations[agency][request_input['Route']
-                                                                                                    ][request_input['Destination']]['Miles']
-                            request_input['Destination Station - Kilometers'] = transit_stations[agency][request_input['Route']
-                                                                                                        ][request_input['Destination']]['Kilometers']
-                        track_miles = round(request_input['Origin Station - Mileage'] -
-                                            request_input['Destination Station - Mileage'], 2)
-                        if track_miles < 0:
-                            track_miles = track_miles * -1
-                        track_kilometers = round(request_input['Origin Station - Kilometers'] -
-                                                request_input['Destination Station - Kilometers'], 2)
-                        if track_kilometers < 0:
-                            track_kilometers = track_kilometers * -1
-                        if agency == 'metra':
-                            request_input['Origin Station - Zone'] = transit_stations[agency][request_input['Route']
-                                                                                            ][request_input['Origin']]['Zone']
-                            request_input['Destination Station - Zone'] = transit_stations[agency][request_input['Route']
-                                                                                                ][request_input['Destination']]['Zone']
-                            if (request_input['Origin Station - Zone'] in [2, 3, 4] and request_input['Destination Station - Zone'] in [2, 3, 4]) or (request_input['Origin Station - Zone'] in [1, 2] and request_input['Destination Station - Zone'] in [1, 2]):
-                                if "Reduced" in request_input['Ticket Type']:
-                                    trip_cost = 1.75
-                                else:
-                                    trip_cost = 3.75
-                            elif (request_input['Origin Station - Zone'] in [1] and request_input['Destination Station - Zone'] in [3]) or (request_input['Origin Station - Zone'] in [3] and request_input['Destination Station - Zone'] in [1]):
-                                if "Reduced" in request_input['Ticket Type']:
-                                    trip_cost = 2.75
-                                else:
-                                    trip_cost = 5.50
-                            elif (request_input['Origin Station - Zone'] in [1] and request_input['Destination Station - Zone'] in [4]) or (request_input['Origin Station - Zone'] in [4] and request_input['Destination Station - Zone'] in [1]):
-                                if "Reduced" in request_input['Ticket Type']:
-                                    trip_cost = 3.25
-                                else:
-                                    trip_cost = 6.75
-                        elif agency == 'cta':
-                            if request_input['Origin'] in ["O'Hare"]:
-                                trip_cost = 5
-                            else:
-                                trip_cost = 2.5
-                        elif agency == 'amtrak':
-                            trip_cost = 0
-                        elif agency == 'southshoreline':
-                            request_input['Origin Station - Zone'] = transit_stations[agency][request_input['Route']
-                                                                                            ][request_input['Origin']]['Zone']
-                            request_input['Destination Station - Zone'] = transit_stations[agency][request_input['Route']
-                                                                                                ][request_input['Destination']]['Zone']
-                            trip_cost = 0
-                        request_input['Track Miles'] = track_miles
-                        request_input['Track Kilometers'] = track_kilometers
-                        request_input['Trip Cost'] = trip_cost
-                        json_file_loaded[username][agency][train_id] = request_input
-                        return_text = {"Status": "Train Added",
-                                    "Username": username,
-                                    "TrainDetails": request_input}
-                        response.status_code = status.HTTP_201_CREATED
+                            return_text = {"Status": "Train Already Present",
+                                        "TrainDetails": await run_in_threadpool(trip_store.get_trip, username, agency, train_id)}
+                            response.status_code = status.HTTP_208_ALREADY_REPORTED
                 elif type == "remove":
-                    if train_id in json_file_loaded[username][agency]:
-                        train_input = json_file_loaded[username][agency][train_id]
-                        json_file_loaded[username][agency].pop(train_id, None)
+                    train_input = await run_in_threadpool(trip_store.remove_trip, username, agency, train_id)
+                    if train_input is not None:
                         return_text = {"Status": "Train Removed",
                                     "Username": username,
                                     "TrainDetails": train_input}
@@ -751,9 +742,6 @@ async def transit_tracker_trips(request: Request, response: Response, user: str,
                         return_text = {
                             "Status": "Failed to Remove Train. Train does not exist.", "TrainID": request_input}
                         response.status_code = status.HTTP_404_NOT_FOUND
-                with open(json_file, 'w', encoding="utf-8") as fp2:
-                    json.dump(json_file_loaded, fp2, indent=4,
-                            separators=(',', ': '), sort_keys=True)
             else:
                 return_text = {
                     "Status": "User Not Found - Unable to Proceed"}
@@ -762,6 +750,95 @@ async def transit_tracker_trips(request: Request, response: Response, user: str,
         else:
             raise HTTPException(
                 status_code=400, detail='Something Went Wrong')
+    except HTTPException:
+        raise
+    except Exception as exc:
+        raise HTTPException(
+            status_code=400, detail='Something Went Wrong') from exc
+
+
+def parse_trip_batch(body):
+    """A JSON array (optionally wrapped in data/body) or NDJSON with one trip per line.
+    Lines that are not valid JSON come back as None so they can be reported individually.
+    A data/body wrapper that is not an array is rejected with 422."""
+    text = body.decode("utf-8").strip()
+    try:
+        request_input = json.loads(text)
+    except json.JSONDecodeError:
+        request_input = None
+    if isinstance(request_input, dict):
+        wrapper = 'data' if 'data' in request_input else 'body' if 'body' in request_input else None
+        if wrapper is None:
+            return [request_input]
+        if not isinstance(request_input[wrapper], list):
+            raise HTTPException(
+                status_code=status.HTTP_422_UNPROCESSABLE_ENTITY, detail=f"'{wrapper}' must be a list of trips")
+        return request_input[wrapper]
+    if isinstance(request_input, list):
+        return request_input
+    trips = []
+    for line in text.splitlines():
+        if line.strip():
+            try:
+                trips.append(json.loads(line))
+            except json.JSONDecodeError:
+                trips.append(None)
+    return trips
+
+
+def add_trip_batch(username, agency, trips):
+    """Enriches every trip, then stores all of the valid ones in one transaction"""
+    results = []
+    valid_trips = []
+    for position, trip in enumerate(trips):
+        if not isinstance(trip, dict):
+            results.append({"Index": position, "Status": "Invalid Trip", "Error": "Not a JSON object"})
+            continue
+        try:
+            train_id = f"{trip['Date']}-{trip['Route']}-{trip['Run Number']}"
+            station_registry.enrich(agency, trip)
+        except (KeyError, TypeError) as exc:
+            results.append({"Index": position, "Status": "Invalid Trip", "Error": f"Missing or unknown {exc}"})
+            continue
+        except MissingTicketType as exc:
+            results.append({"Index": position, "Status": "Invalid Trip", "Error": str(exc)})
+            continue
+        results.append({"Index": position, "TrainID": train_id})
+        valid_trips.append((train_id, trip))
+    added = iter(trip_store.add_trips(username, agency, valid_trips))
+    for result in results:
+        if "TrainID" in result:
+            result["Status"] = "Train Added" if next(added) else "Train Already Present"
+    return results
+
+
+@app.post("/api/transit/post/batch", dependencies=[Depends(RateLimiter(times=2, seconds=1))], status_code=200)
+async def transit_tracker_trips_batch(request: Request, response: Response, user: str, auth_token: str, agency: str):
+    """Used to add many trips at once"""
+    try:
+        if auth_token == api_auth_token:
+            username = user.upper()
+            trips = parse_trip_batch(await request.body())
+            if len(trips) > max_trip_batch:
+                raise HTTPException(
+                    status_code=413, detail=f'No more than {max_trip_batch} trips per batch')
+            if not await run_in_threadpool(trip_store.has_user, username):
+                response.status_code = status.HTTP_404_NOT_FOUND
+                return {"Status": "User Not Found - Unable to Proceed"}
+            results = await run_in_threadpool(add_trip_batch, username, agency, trips)
+            statuses = [result["Status"] for result in results]
+            if "Train Added" in statuses:
+                response.status_code = status.HTTP_201_CREATED
+            return {"Username": username,
+                    "Added": statuses.count("Train Added"),
+                    "AlreadyPresent": statuses.count("Train Already Present"),
+                    "Invalid": statuses.count("Invalid Trip"),
+                    "Results": results}
+        else:
+            raise HTTPException(
+                status_code=400, detail='Something Went Wrong')
+    except HTTPException:
+        raise
     except Exception as exc:
         raise HTTPException(
             status_code=400, detail='Something Went Wrong') from exc
@@ -773,42 +850,42 @@ async def get_transit_tracker_trips(user: str, auth_token: str, output_type: str
     try:
         user_input = user.upper()
         if output_type.upper() == "JSON" and auth_token == api_auth_token:
-            json_file = main_file_path_transit_data + "transit_trips.json"
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
-            if user_input == "ALL_USERS":
-                return JSONResponse(content=jsonable_encoder(json_file_loaded))
-            else:
-                return JSONResponse(content=jsonable_encoder(json_file_loaded[user_input]))
-        elif output_type.upper() == "CSV" and auth_token == api_auth_token:
-            output_text = "User,Date,Agency,Route,RunNumber,Origin,Origin_Zone,Origin_Miles,Origin_Kilometers,Destination,Destination_Zone,Destination_Miles,Destination_Kilometers,Trip_Miles,Trip_Kilometers,Trip_Cost,Ticket_Type"
-            json_file = main_file_path_transit_data + "transit_trips.json"
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
             if user_input == "ALL_USERS":
-                for username in json_file_loaded:
-                    for agency_trip in json_file_loaded[username]:
-                        for item in json_file_loaded[username][agency_trip]:
-                            trip_cost = f"{json_file_loaded[username][agency_trip][item]['Trip Cost']:.2f}"
-                            if agency_trip == 'metra':
-                                new_line = f"{username},{json_file_loaded[username][agency_trip][item]['Date']},{agency_trip},{json_file_loaded[username][agency_trip][item]['Route']},{json_file_loaded[username][agency_trip][item]['Run Number']},{json_file_loaded[username][agency_trip][item]['Origin']},{json_file_loaded[username][agency_trip][item]['Origin Station - Zone']},{json_file_loaded[username][agency_trip][item]['Origin Station - Mileage']},{json_file_loaded[username][agency_trip][item]['Origin Station - Kilometers']},{json_file_loaded[username][agency_trip][item]['Destination']},{json_file_loaded[username][agency_trip][item]['Destination Station - Zone']},{json_file_loaded[username][agency_trip][item]['Destination Station - Mileage']},{json_file_loaded[username][agency_trip][item]['Destination Station - Kilometers']},{json_file_loaded[username][agency_trip][item]['Track Miles']},{json_file_loaded[username][agency_trip][item]['Track Kilometers']},{trip_cost},{json_file_loaded[username][agency_trip][item]['Ticket Type']}"
-                            elif agency_trip in ['cta', 'amtrak', 'southshoreline']:
-                                new_line = f"{username},{json_file_loaded[username][agency_trip][item]['Date']},{agency_trip},{json_file_loaded[username][agency_trip][item]['Route']},{json_file_loaded[username][agency_trip][item]['Run Number']},{json_file_loaded[username][agency_trip][item]['Origin']},,{json_file_loaded[username][agency_trip][item]['Origin Station - Mileage']},{json_file_loaded[username][agency_trip][item]['Origin Station - Kilometers']},{json_file_loaded[username][agency_trip][item]['Destination']},,{json_file_loaded[username][agency_trip][item]['Destination Station - Mileage']},{json_file_loaded[username][agency_trip][item]['Destination Station - Kilometers']},{json_file_loaded[username][agency_trip][item]['Track Miles']},{json_file_loaded[username][agency_trip][item]['Track Kilometers']},"
-                            output_text = f"{output_text}\n{new_line}"
-            elif user_input in json_file_loaded:
-                for agency_trip in json_file_loaded[user_input]:
-                    for item in json_file_loaded[user_input][agency_trip]:
-                        trip_cost = f"{json_file_loaded[user_input][agency_trip][item]['Trip Cost']:.2f}"
-                        if agency_trip == 'metra':
-                            new_line = f"{user_input},{json_file_loaded[user_input][agency_trip][item]['Date']},{agency_trip},{json_file_loaded[user_input][agency_trip][item]['Route']},{json_file_loaded[user_input][agency_trip][item]['Run Number']},{json_file_loaded[user_input][agency_trip][item]['Origin']},,{json_file_loaded[user_input][agency_trip][item]['Origin Station - Mileage']},{json_file_loaded[user_input][agency_trip][item]['Origin Station - Kilometers']},{json_file_loaded[user_input][agency_trip][item]['Destination']},,{json_file_loaded[user_input][agency_trip][item]['Destination Station - Mileage']},{json_file_loaded[user_input][agency_trip][item]['Destination Station - Kilometers']},{json_file_loaded[user_input][agency_trip][item]['Track Miles']},{json_file_loaded[user_input][agency_trip][item]['Track Kilometers']},{trip_cost},{json_file_loaded[user_input][agency_trip][item]['Ticket Type']}"
-                        elif agency_trip in ['cta', 'amtrak', 'southshoreline']:
-                            new_line = f"{user_input},{json_file_loaded[user_input][agency_trip][item]['Date']},{agency_trip},{json_file_loaded[user_input][agency_trip][item]['Route']},{json_file_loaded[user_input][agency_trip][item]['Run Number']},{json_file_loaded[user_input][agency_trip][item]['Origin']},,{json_file_loaded[user_input][agency_trip][item]['Origin Station - Mileage']},{json_file_loaded[user_input][agency_trip][item]['Origin Station - Kilometers']},{json_file_loaded[user_input][agency_trip][item]['Destination']},,{json_file_loaded[user_input][agency_trip][item]['Destination Station - Mileage']},{json_file_loaded[user_input][agency_trip][item]['Destination Station - Kilometers']},{json_file_loaded[user_input][agency_trip][item]['Track Miles']},{json_file_loaded[user_input][agency_trip][item]['Track Kilometers']},{trip_cost},"
-                        output_text = f"{output_text}\n{new_line}"
+                return JSONResponse(content=jsonable_encoder(await run_in_threadpool(trip_store.all_trips)))
             else:
+                user_trips = await run_in_threadpool(trip_store.user_trips, user_input)
+                if user_trips is None:
+                    raise HTTPException(
+                        status_code=401, detail='User Not Found')
+                return JSONResponse(content=jsonable_encoder(user_trips))
+        elif output_type.upper() in EXPORT_FORMATS and auth_token == api_auth_token:
+            media_type, extension, encoder = EXPORT_FORMATS[output_type.upper()]
+            if user_input != "ALL_USERS" and not await run_in_threadpool(trip_store.has_user, user_input):
                 raise HTTPException(
                     status_code=401, detail='User Not Found')
-            return Response(content=output_text, media_type="text/csv", headers={
-                "Content-Disposition": f"attachment; filename=transit-trips-{user_input}.csv"})
+            trips = trip_store.iter_trips(None if user_input == "ALL_USERS" else user_input)
+            return StreamingResponse(encoder(trips), media_type=media_type, headers={
+                "Content-Disposition": f"attachment; filename=transit-trips-{user_input}.{extension}"})
+    except Exception as exc:
+        raise HTTPException(
+            status_code=404, detail='Unable to provide results') from exc
+
+
+@app.get("/api/transit/summary", dependencies=[Depends(RateLimiter(times=2, seconds=1))], status_code=200)
+async def get_transit_tracker_summary(user: str, auth_token: str, agency: str = None, month: str = None):
+    """Used to retrieve trip totals (trips, miles, kilometers, cost) by agency and month"""
+    try:
+        user_input = user.upper()
+        if auth_token == api_auth_token:
+            if user_input != "ALL_USERS" and not await run_in_threadpool(trip_store.has_user, user_input):
+                raise HTTPException(
+                    status_code=401, detail='User Not Found')
+            summary = await run_in_threadpool(
+                trip_store.summary, None if user_input == "ALL_USERS" else user_input, agency, month)
+            return {"Username": user_input, **summary}
+        else:
+            raise HTTPException(
+                status_code=400, detail='Something Went Wrong')
     except Exception as exc:
         raise HTTPException(
             status_code=404, detail='Unable to provide results') from exc
@@ -818,10 +895,7 @@ async def get_transit_tracker_trips(user: str, auth_token: str, output_type: str
 async def transit_data_password_check(request: Request, response: Response):
     """Used to retrieve results"""
     try:
-        file = open(file=api_file_path + '.transit_data_tokens',
-                    mode='r',
-                    encoding='utf-8')
-        transit_tokens = json.load(file)
+        transit_tokens = transit_tokens_document.read()
         request_input = await request.json()
         if request_input['Username'].upper() in transit_tokens:
             if request_input['Password'] == transit_tokens[request_input['Username'].upper()]:
@@ -843,36 +917,28 @@ async def transit_data_password_check(request: Request, response: Response):
 async def transit_data_new_user(request: Request, response: Response):
     """Used to retrieve results"""
     try:
-        file = open(file=api_file_path + '.transit_data_tokens',
-                    mode='r',
-                    encoding='utf-8')
-        transit_tokens = json.load(file)
         request_input = await request.json()
         if 'data' in request_input:
             request_input = request_input['data']
         elif 'body' in request_input:
             request_input = request_input['body']
-        if request_input['Username'].upper() in transit_tokens:
-            return_text = {
-                "Status": "User Already Exists. If you need a password change, contact Brandon :)"}
-            response.status_code = status.HTTP_208_ALREADY_REPORTED
-        else:
-            json_file = main_file_path_transit_data + "transit_trips.json"
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
-            username = request_input['Username'].upper()
-            password = request_input['Password']
+        username = request_input['Username'].upper()
+        password = request_input['Password']
+
+        def add_transit_user(transit_tokens):
+            if username in transit_tokens:
+                return False
             transit_tokens[username] = password
-            json_file_loaded[username] = {}
+            return True
+        if await run_in_threadpool(transit_tokens_document.update, add_transit_user):
             return_text = {"Status": "User Created",
                            "Username": username, "Password": password}
             response.status_code = status.HTTP_202_ACCEPTED
-            with open(api_file_path + '.transit_data_tokens', 'w', encoding="utf-8") as fp2:
-                json.dump(transit_tokens, fp2, indent=4,
-                          separators=(',', ': '))
-            with open(json_file, 'w', encoding="utf-8") as fp2:
-                json.dump(json_file_loaded, fp2, indent=4,
-                          separators=(',', ': '))
+            await run_in_threadpool(trip_store.add_user, username)
+        else:
+            return_text = {
+                "Status": "User Already Exists. If you need a password change, contact Brandon :)"}
+            response.status_code = status.HTTP_208_ALREADY_REPORTED
         return return_text
     except Exception as exc:
         raise HTTPException(
@@ -880,38 +946,37 @@ async def transit_data_new_user(request: Request, response: Response):
 
 
 @app.get("/api/articles/get", status_code=200)
-async def get_articles():
-    """Used to retrieve results"""
+async def get_articles(request: Request, year: str = None, organization: str = None, since: str = None,
+                       limit: int = None, cursor: str = None):
+    """Used to retrieve results - the whole document, or newest first when filtered or paged"""
+    if year is None and organization is None and since is None and limit is None and cursor is None:
+        try:
+            return await serve_document(request, articles_document)
+        except:  # pylint: disable=bare-except
+            endpoint = "https://brandonmcfadden.com/api/articles/get/"
+            return generate_html_response_error(get_date("current"), endpoint, get_date("current"))
+    if limit is not None and limit < 1:
+        raise HTTPException(status_code=400, detail="limit must be at least 1")
     try:
-        json_file = api_file_path + "data/articles.json"
-        results = open(json_file, 'r', encoding="utf-8")
-        return Response(content=results.read(), media_type="application/json")
+        return await run_in_threadpool(articles_index.query, year, organization, since, limit, cursor)
+    except (ValueError, UnicodeDecodeError) as exc:
+        raise HTTPException(status_code=400, detail="Invalid since or cursor") from exc
     except:  # pylint: disable=bare-except
         endpoint = "https://brandonmcfadden.com/api/articles/get/"
         return generate_html_response_error(get_date("current"), endpoint, get_date("current"))
 
 
 @app.post("/api/articles/post")
-async def post_articles(request: Request, response: Response, auth_token: str, year: str, token: str = Depends(get_current_username)):
+async def post_articles(request: Request, response: Response, auth_token: str, year: str, token: str = Depends(get_current_username_unmetered)):
     """Used to retrieve results"""
     try:
         if auth_token == api_auth_token:
-            json_file = api_file_path + "data/articles.json"
             request_body_input = await request.json()
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
-            if year in json_file_loaded:
-                json_file_loaded[year].insert(0, request_body_input)
+            if await run_in_threadpool(articles_index.add, year, request_body_input):
                 response.status_code = status.HTTP_202_ACCEPTED
             else:
-                json_file_loaded[year] = []
-                json_file_loaded[year].insert(0, request_body_input)
                 response.status_code = status.HTTP_201_CREATED
-            with open(json_file, 'w', encoding="utf-8") as fp2:
-                json.dump(json_file_loaded, fp2, indent=4,
-                          separators=(',', ': '))
-            results = open(json_file, 'r', encoding="utf-8")
-            return Response(content=results.read(), media_type="application/json")
+            return await serve_document(request, articles_document, status_code=response.status_code)
         else:
             raise HTTPException(
                 status_code=401, detail="Auth Token not Provided")
@@ -924,14 +989,12 @@ async def post_battery_data(battery: str, miles: str, date: str, time: str, auth
     """Used to retrieve results"""
     try:
         if auth_token == api_auth_token:
-            json_file = api_file_path + "data/tesla.json"
-            input_json = {"Date":date,"Time":time,"Battery": battery,"MilesRemaining":miles}
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
-
-            last_entry = json_file_loaded[-1]
+            last_entry = await run_in_threadpool(tesla_store.append, date, time, battery, miles)
+            current_entry_text = f"New Entry Date:{date} {time}\nNew Entry: {miles} miles ({battery}%)"
+            response.status_code = status.HTTP_202_ACCEPTED
+            if last_entry is None:
+                return current_entry_text
             last_entry_text = f"Last Entry Date:{last_entry['Date']} {last_entry['Time']}\nLast Entry: {last_entry['MilesRemaining']} miles ({last_entry['Battery']}%)"
-            current_entry_text = f"New Entry Date:{input_json['Date']} {input_json['Time']}\nNew Entry: {miles} miles ({battery}%)"
             miles_different = str(int(miles)-int(last_entry["MilesRemaining"]))
             percent_different = str(int(battery)-int(last_entry["Battery"]))
             if int(miles_different) > 0:
@@ -944,11 +1007,6 @@ async def post_battery_data(battery: str, miles: str, date: str, time: str, auth
                 added_text_2 = ""
             difference = f"Miles: {added_text_1}{miles_different}\nBattery: {added_text_2}{percent_different}%"
             combined_return_text = f"{last_entry_text}\n\n{current_entry_text}\n\n{difference}"
-            json_file_loaded.append(input_json)
-            response.status_code = status.HTTP_202_ACCEPTED
-            with open(json_file, 'w', encoding="utf-8") as fp2:
-                json.dump(json_file_loaded, fp2, indent=4,
-                            separators=(',', ': '))
             return combined_return_text
         else:
             raise HTTPException(
@@ -958,35 +1016,22 @@ async def post_battery_data(battery: str, miles: str, date: str, time: str, auth
             status_code=400, detail='Something Went Wrong') from exc
 
 @app.get("/api/tesla/get", response_class=PlainTextResponse)
-async def get_battery_data(entries: str, auth_token: str, response: Response):
-    """Used to retrieve results"""
+async def get_battery_data(auth_token: str, response: Response, entries: str = None, start: str = Query(None, alias="from"), end: str = Query(None, alias="to"), downsample: str = None):
+    """Used to retrieve results - newest first, optionally limited to from=/to= dates or downsampled with downsample=daily"""
     try:
         if auth_token == api_auth_token:
-            json_file = api_file_path + "data/tesla.json"
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
-            if entries == "all":
-                entries_to_get = len(json_file_loaded)*-1
-            elif int(entries) > len(json_file_loaded):
-                entries_to_get = len(json_file_loaded)*-1
-            else:
-                entries_to_get = int(entries)*-1
-            output = ""
-            print(entries_to_get)
-            while entries_to_get < 0:
-                try:
-                    last_entry = json_file_loaded[entries_to_get]
-                    last_entry_text = f"Date:{last_entry['Date']} {last_entry['Time']} - {last_entry['MilesRemaining']} miles ({last_entry['Battery']}%)"
-                    output = f"{last_entry_text}\n{output}"
-                    entries_to_get += 1
-                except:
-                    entries_to_get += 1
-                    continue
             response.status_code = status.HTTP_200_OK
-            with open(json_file, 'w', encoding="utf-8") as fp2:
-                json.dump(json_file_loaded, fp2, indent=4,
-                            separators=(',', ': '))
-            return output
+            if downsample == "daily":
+                return JSONResponse(content=await run_in_threadpool(tesla_store.daily, start, end))
+            if start or end:
+                readings = await run_in_threadpool(tesla_store.between, start, end)
+                if entries not in (None, "all"):
+                    readings = readings[len(readings) - max(int(entries), 0):]
+            else:
+                readings = await run_in_threadpool(
+                    tesla_store.tail, None if entries in (None, "all") else int(entries))
+            return "".join(f"Date:{reading['Date']} {reading['Time']} - {reading['MilesRemaining']} miles ({reading['Battery']}%)\n"
+                           for reading in reversed(readings))
         else:
             raise HTTPException(
                 status_code=401, detail="Auth Token not Provided")
@@ -999,18 +1044,10 @@ async def undo_battery_data(auth_token: str, response: Response):
     """Used to retrieve results"""
     try:
         if auth_token == api_auth_token:
-            json_file = api_file_path + "data/tesla.json"
-            with open(json_file, 'r', encoding="utf-8") as fp:
-                json_file_loaded = json.load(fp)
-
-            last_entry = json_file_loaded[-1]
+            last_entry = await run_in_threadpool(tesla_store.undo)
             last_entry_text = f"Last Entry Date:{last_entry['Date']} {last_entry['Time']}\nLast Entry: {last_entry['MilesRemaining']} miles ({last_entry['Battery']}%)"
             combined_return_text = f"Entry Removed:\n{last_entry_text}"
             response.status_code = status.HTTP_202_ACCEPTED
-            del json_file_loaded[-1]
-            with open(json_file, 'w', encoding="utf-8") as fp2:
-                json.dump(json_file_loaded, fp2, indent=4,
-                            separators=(',', ': '))
             return combined_return_text
         else:
             raise HTTPException(
@@ -0,0 +1,178 @@
+"""columns=, line=, station=, start_time= and end_time= handling shared by the arrivals endpoints"""
+import csv
+import hashlib
+import io
+import re
+
+TIME_COLUMN = "Arrival_Time"
+LINE_COLUMNS = ("Line", "Train_Line", "Line_Name", "Route", "Route_Name")
+STATION_COLUMNS = ("Station", "Station_Name", "Stop_Name", "Stop")
+TIME_PATTERN = re.compile(r"^(\d{2}):(\d{2})(?::(\d{2}))?$")
+ROWS_PER_CHUNK = 5000
+
+
+def _split(value):
+    return [item.strip() for item in value.split(",") if item.strip()] if value else []
+
+
+def _normalise_time(value):
+    if value is None:
+        return None
+    match = TIME_PATTERN.match(value.strip())
+    if not match:
+        raise ValueError(f"Invalid time: {value}")
+    return f"{match.group(1)}:{match.group(2)}:{match.group(3) or '00'}"
+
+
+def _find_column(header, candidates, label):
+    lowered = {name.lower(): name for name in header}
+    for candidate in candidates:
+        if candidate.lower() in lowered:
+            return lowered[candidate.lower()]
+    raise ValueError(f"No {label} column available")
+
+
+def _in_window(time_of_day, start_time, end_time):
+    if start_time and end_time and start_time > end_time:  # overnight window, e.g. 22:00 to 02:00
+        return time_of_day >= start_time or time_of_day < end_time
+    return (start_time is None or time_of_day >= start_time) and (end_time is None or time_of_day < end_time)
+
+
+class ArrivalsFilter:
+    """What the client asked for, before we know which columns the source actually has"""
+
+    def __init__(self, columns=None, line=None, station=None, start_time=None, end_time=None):
+        self.columns = _split(columns)
+        self.lines = [value.lower() for value in _split(line)]
+        self.stations = [value.lower() for value in _split(station)]
+        self.start_time = _normalise_time(start_time)
+        self.end_time = _normalise_time(end_time)
+
+    @property
+    def is_empty(self):
+        return not (self.columns or self.lines or self.stations or self.start_time or self.end_time)
+
+    def cache_key(self):
+        """Stable short digest of the filter, used for ETags and cache keys"""
+        text = repr((self.columns, self.lines, self.stations, self.start_time, self.end_time))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()[:16]
+
+    def resolve(self, header):
+        """Maps the request onto a real header - raises ValueError for columns that do not exist"""
+        return ResolvedFilter(self, list(header))
+
+
+class ResolvedFilter:
+    """An ArrivalsFilter bound to actual column names"""
+
+    def __init__(self, arrivals_filter, header):
+        self.filter = arrivals_filter
+        lowered = {name.lower(): name for name in header}
+        if arrivals_filter.columns:
+            unknown = [name for name in arrivals_filter.columns if name.lower() not in lowered]
+            if unknown:
+                raise ValueError(f"Unknown columns: {', '.join(unknown)}")
+            self.columns = [lowered[name.lower()] for name in arrivals_filter.columns]
+        else:
+            self.columns = list(header)
+        self.line_column = _find_column(header, LINE_COLUMNS, "line") if arrivals_filter.lines else None
+        self.station_column = _find_column(header, STATION_COLUMNS, "station") if arrivals_filter.stations else None
+        has_window = arrivals_filter.start_time or arrivals_filter.end_time
+        self.time_column = _find_column(header, (TIME_COLUMN,), "arrival time") if has_window else None
+        index = {name: position for position, name in enumerate(header)}
+        self._column_indexes = [index[name] for name in self.columns]
+        self._line_index = index.get(self.line_column)
+        self._station_index = index.get(self.station_column)
+        self._time_index = index.get(self.time_column)
+
+    @property
+    def needed_columns(self):
+        """Columns that have to be read: the projection plus anything we filter on"""
+        needed = list(self.columns)
+        for name in (self.line_column, self.station_column, self.time_column):
+            if name and name not in needed:
+                needed.append(name)
+        return needed
+
+    def matches(self, row):
+        """Row filter for a full CSV row (list of strings in header order)"""
+        if self._line_index is not None and row[self._line_index].lower() not in self.filter.lines:
+            return False
+        if self._station_index is not None and row[self._station_index].lower() not in self.filter.stations:
+            return False
+        if self._time_index is not None:
+            return _in_window(row[self._time_index][11:19], self.filter.start_time, self.filter.end_time)
+        return True
+
+    def project(self, row):
+        return [row[position] for position in self._column_indexes]
+
+    def sql(self, quote, placeholder, time_of_day):
+        """(select list, where clauses) for SQL backends. placeholder(value) returns the bind marker
+        for a value and time_of_day(column) the expression giving HH:MM:SS for the arrival time."""
+        select = ", ".join(quote(name) for name in self.columns)
+        where = []
+        for column, values in ((self.line_column, self.filter.lines), (self.station_column, self.filter.stations)):
+            if column:
+                markers = ", ".join(placeholder(value) for value in values)
+                where.append(f"LOWER({quote(column)}) IN ({markers})")
+        if self.time_column:
+            expression = time_of_day(quote(self.time_column))
+            start, end = self.filter.start_time, self.filter.end_time
+            if start and end and start > end:
+                where.append(f"({expression} >= {placeholder(start)} OR {expression} < {placeholder(end)})")
+            else:
+                if start:
+                    where.append(f"{expression} >= {placeholder(start)}")
+                if end:
+                    where.append(f"{expression} < {placeholder(end)}")
+        return select, where
+
+    def arrow_filter(self, table):
+        """Applies the row filter and projection to a pyarrow Table"""
+        import pyarrow as pa  # pylint: disable=import-outside-toplevel
+        import pyarrow.compute as pc  # pylint: disable=import-outside-toplevel
+        mask = None
+        for column, values in ((self.line_column, self.filter.lines), (self.station_column, self.filter.stations)):
+            if column:
+                condition = pc.is_in(pc.utf8_lower(table[column]), value_set=pa.array(values))
+                mask = condition if mask is None else pc.and_(mask, condition)
+        if self.time_column:
+            time_of_day = pc.utf8_slice_codeunits(table[self.time_column], 11, 19)
+            start, end = self.filter.start_time, self.filter.end_time
+            after_start = pc.greater_equal(time_of_day, start) if start else None
+            before_end = pc.less(time_of_day, end) if end else None
+            if after_start is not None and before_end is not None:
+                condition = pc.or_(after_start, before_end) if start > end else pc.and_(after_start, before_end)
+            else:
+                condition = after_start if after_start is not None else before_end
+            mask = condition if mask is None else pc.and_(mask, condition)
+        if mask is not None:
+            table = table.filter(mask)
+        return table.select(self.columns)
+
+
+def read_csv_header(path):
+    with open(path, 'r', encoding="utf-8", newline="") as fp:
+        return next(csv.reader(fp), [])
+
+
+def iter_filtered_csv(path, resolved, rows_per_chunk=ROWS_PER_CHUNK):
+    """One streaming pass over a CSV file, yielding encoded chunks of the matching, projected rows"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    writer.writerow(resolved.columns)
+    pending = 0
+    with open(path, 'r', encoding="utf-8", newline="") as fp:
+        reader = csv.reader(fp)
+        next(reader, None)
+        for row in reader:
+            if row and resolved.matches(row):
+                writer.writerow(resolved.project(row))
+                pending += 1
+                if pending >= rows_per_chunk:
+                    yield buffer.getvalue().encode("utf-8")
+                    buffer.seek(0)
+                    buffer.truncate()
+                    pending = 0
+    yield buffer.getvalue().encode("utf-8")
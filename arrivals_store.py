@@ -0,0 +1,247 @@
+"""Date-partitioned Parquet copy of the arrivals CSVs so range queries can be answered locally"""
+import calendar
+import csv
+import os
+import threading
+from datetime import date as date_type, datetime, timedelta
+from lazy_imports import lazy_import
+from warehouse import PAGE_SIZE
+
+# pyarrow is imported on first use; without it (pa is None) every range query goes to the warehouse
+pa = lazy_import("pyarrow", optional=True)
+pc = lazy_import("pyarrow.compute")
+pa_csv = lazy_import("pyarrow.csv")
+pq = lazy_import("pyarrow.parquet")
+
+TIME_COLUMN = "Arrival_Time"
+# Written to parquet_directory/LAYOUT once every partition is cut by calendar date; partitions from
+# before it (cut by service day) are all rewritten on the next compaction
+LAYOUT = "arrival-date"
+
+
+def _read_csv_as_strings(path):
+    """Every column is kept as text so the CSV we stream back matches the CSV we were given"""
+    with open(path, 'r', encoding="utf-8", newline="") as fp:
+        header = next(csv.reader(fp))
+    return pa_csv.read_csv(path, convert_options=pa_csv.ConvertOptions(
+        column_types={name: pa.string() for name in header}, strings_can_be_null=False))
+
+
+def _days(first_day, last_day):
+    day = date_type.fromisoformat(first_day)
+    end = date_type.fromisoformat(last_day)
+    while day <= end:
+        yield day.isoformat()
+        day += timedelta(days=1)
+
+
+def _next_day(day):
+    return (date_type.fromisoformat(day) + timedelta(days=1)).isoformat()
+
+
+def _previous_day(day):
+    return (date_type.fromisoformat(day) - timedelta(days=1)).isoformat()
+
+
+def _normalise_time(value):
+    return value.replace(" ", "T")
+
+
+class ParquetArrivalsStore:
+    """One Parquet file per calendar date of Arrival_Time under parquet_directory/date=YYYY-MM-DD/.
+
+    The CSVs are service days, so a day's file also holds the arrivals just after midnight - each
+    partition is cut from its own day's file and the previous day's, whichever CSV they came from."""
+
+    def __init__(self, csv_directory, csv_month_directory, parquet_directory):
+        self.csv_directory = csv_directory
+        self.csv_month_directory = csv_month_directory
+        self.parquet_directory = parquet_directory
+        self._lock = threading.Lock()
+        self.stats = {"PartitionsWritten": 0, "Errors": 0}
+
+    @property
+    def enabled(self):
+        return pa is not None
+
+    def partition_path(self, day):
+        return os.path.join(self.parquet_directory, f"date={day}", "part-0.parquet")
+
+    def available_dates(self):
+        """Sorted dates that have a partition"""
+        try:
+            entries = os.listdir(self.parquet_directory)
+        except FileNotFoundError:
+            return []
+        return sorted(entry[5:] for entry in entries if entry.startswith("date="))
+
+    def _write_partition(self, day, table, source_stat):
+        path = self.partition_path(day)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{os.getpid()}.tmp"
+        table = table.sort_by(TIME_COLUMN) if TIME_COLUMN in table.column_names else table
+        pq.write_table(table, temp_path, compression="zstd")
+        os.utime(temp_path, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        os.replace(temp_path, path)
+        self.stats["PartitionsWritten"] += 1
+
+    def _layout_path(self):
+        return os.path.join(self.parquet_directory, "LAYOUT")
+
+    def _has_layout(self):
+        try:
+            with open(self._layout_path(), 'r', encoding="utf-8") as fp:
+                return fp.read().strip() == LAYOUT
+        except FileNotFoundError:
+            return False
+
+    def _is_current(self, day, source_stat):
+        try:
+            return os.stat(self.partition_path(day)).st_mtime_ns >= source_stat.st_mtime_ns
+        except FileNotFoundError:
+            return False
+
+    def _service_day_sources(self, cutoff):
+        """{service day: CSV holding it} for days before cutoff - the daily file, or else the monthly one"""
+        sources = {}
+        if os.path.isdir(self.csv_month_directory):
+            for filename in os.listdir(self.csv_month_directory):
+                month, extension = os.path.splitext(filename)
+                if extension == ".csv" and not filename.startswith(".") and month < cutoff[:7]:
+                    try:
+                        year, month_number = (int(part) for part in month.split("-"))
+                    except ValueError:
+                        continue
+                    last_day = calendar.monthrange(year, month_number)[1]
+                    for day in _days(f"{month}-01", f"{month}-{last_day:02d}"):
+                        sources[day] = os.path.join(self.csv_month_directory, filename)
+        if os.path.isdir(self.csv_directory):
+            for filename in os.listdir(self.csv_directory):
+                day, extension = os.path.splitext(filename)
+                if extension == ".csv" and not filename.startswith(".") and day < cutoff:
+                    sources[day] = os.path.join(self.csv_directory, filename)
+        return sources
+
+    def compact(self, cutoff=None):
+        """Converts finished daily CSVs (and days only present in monthly CSVs) that sort before cutoff,
+        which defaults to yesterday"""
+        if not self.enabled:
+            return
+        cutoff = cutoff or datetime.strftime(datetime.now() - timedelta(days=1), "%Y-%m-%d")
+        with self._lock:
+            sources = self._service_day_sources(cutoff)
+            rewrite = not self._has_layout()
+            errors = self.stats["Errors"]
+            tables = {}
+            for day in sorted(sources):
+                paths = list(dict.fromkeys(sources[service_day] for service_day in (_previous_day(day), day)
+                                           if service_day in sources))
+                try:
+                    source_stat = max((os.stat(path) for path in paths), key=lambda stat_result: stat_result.st_mtime_ns)
+                    if not rewrite and self._is_current(day, source_stat):
+                        continue
+                    # Only this day's and the previous day's CSVs are needed, so two tables are kept
+                    tables = {path: tables[path] if path in tables else _read_csv_as_strings(path) for path in paths}
+                    table = pa.concat_tables(list(tables.values())) if len(tables) > 1 else tables[paths[0]]
+                    day_table = table.filter(pc.equal(pc.utf8_slice_codeunits(table[TIME_COLUMN], 0, 10), day))
+                    if day_table.num_rows:
+                        self._write_partition(day, day_table, source_stat)
+                except (OSError, ValueError, KeyError, pa.ArrowException):
+                    self.stats["Errors"] += 1
+            if rewrite and self.stats["Errors"] == errors:
+                os.makedirs(self.parquet_directory, exist_ok=True)
+                with open(self._layout_path(), 'w', encoding="utf-8") as fp:
+                    fp.write(LAYOUT)
+
+    def plan(self, startdate, enddate):
+        """Splits [startdate, enddate) into runs of days that are ("local", days) or ("missing", days)"""
+        first_day = startdate[:10]
+        last_day = enddate[:10] if len(enddate) > 10 else (date_type.fromisoformat(enddate[:10]) - timedelta(days=1)).isoformat()
+        available = set(self.available_dates()) if self.enabled else set()
+        segments = []
+        for day in _days(first_day, last_day):
+            kind = "local" if day in available else "missing"
+            if segments and segments[-1][0] == kind:
+                segments[-1][1].append(day)
+            else:
+                segments.append((kind, [day]))
+        return segments
+
+    def read_pages(self, days, startdate, enddate, page_size, resolved=None):
+        """Rows for the given partitions, each cut to the part of the window it covers.
+        A resolved ArrivalsFilter limits the columns read and is applied to each partition."""
+        start, end = _normalise_time(startdate), _normalise_time(enddate)
+        columns = None
+        if resolved is not None:
+            columns = resolved.needed_columns
+            if TIME_COLUMN not in columns:
+                columns = columns + [TIME_COLUMN]
+        for day in days:
+            table = pq.read_table(self.partition_path(day), columns=columns)
+            arrival_times = pc.replace_substring(table[TIME_COLUMN], " ", "T")
+            table = table.filter(pc.and_(pc.greater_equal(arrival_times, max(start, day)),
+                                         pc.less(arrival_times, min(end, _next_day(day)))))
+            if resolved is not None:
+                table = resolved.arrow_filter(table)
+            for batch in table.to_batches(max_chunksize=page_size):
+                if batch.num_rows:
+                    yield list(zip(*(column.to_pylist() for column in batch.columns)))
+
+    def columns(self, day):
+        return pq.read_schema(self.partition_path(day)).names
+
+
+class LocalFirstArrivalsBackend:
+    """Answers from the Parquet store and only asks the remote backend for days it does not have"""
+
+    def __init__(self, store, remote):
+        self.store = store
+        self.remote = remote
+        self.stats = {"LocalDays": 0, "RemoteDays": 0, "Mismatches": 0}
+
+    def query(self, startdate, enddate, page_size=PAGE_SIZE, row_filter=None):
+        """Same contract as the warehouse backends: (columns, lazy pages)"""
+        if row_filter is not None and row_filter.is_empty:
+            row_filter = None
+        segments = []
+        remote_columns = None
+        for kind, days in self.store.plan(startdate, enddate):
+            if kind == "local":
+                local_columns = self.store.columns(days[0])
+                resolved = row_filter.resolve(local_columns) if row_filter is not None else None
+                segments.append((kind, days, resolved.columns if resolved is not None else local_columns, resolved))
+            else:
+                if remote_columns is None:
+                    remote_columns = self.remote.columns(row_filter)
+                segments.append((kind, days, remote_columns, None))
+        if not any(kind == "local" for kind, _, _, _ in segments):
+            return self.remote.query(startdate, enddate, page_size, row_filter)
+        columns = list(segments[0][2])
+        if any(not set(columns) <= set(segment_columns) for _, _, segment_columns, _ in segments[1:]):
+            # The CSV header and the warehouse schema disagree, so rows cannot be merged safely -
+            # checked before any remote segment runs, so the window is only queried once
+            self.stats["Mismatches"] += 1
+            return self.remote.query(startdate, enddate, page_size, row_filter)
+        sources = []
+        for kind, days, segment_columns, resolved in segments:
+            segment_start = max(startdate, days[0])
+            segment_end = min(enddate, _next_day(days[-1]))
+            if kind == "local":
+                self.stats["LocalDays"] += len(days)
+                sources.append((segment_columns, self.store.read_pages(days, segment_start, segment_end,
+                                                                       page_size, resolved)))
+            else:
+                self.stats["RemoteDays"] += len(days)
+                sources.append(self.remote.query(segment_start, segment_end, page_size, row_filter))
+        return columns, (page for source_columns, pages in sources
+                         for page in _project(pages, source_columns, columns))
+
+
+def _project(pages, source_columns, columns):
+    """Reorders (and narrows) rows from source_columns to columns"""
+    if list(source_columns) == columns:
+        yield from pages
+        return
+    indexes = [list(source_columns).index(column) for column in columns]
+    for page in pages:
+        yield [tuple(row[index] for index in indexes) for row in page]
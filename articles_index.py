@@ -0,0 +1,117 @@
+"""Articles across every year ordered by date, for filtered and paged reads of data/articles.json"""
+import base64
+from bisect import bisect_left
+from datetime import date as date_type
+import threading
+from dateutil import parser as date_parser
+
+
+def article_date(article, year):
+    """The article's date, or 1 January of its year if the date is missing or unreadable"""
+    try:
+        return date_parser.parse(article["date"]).date()
+    except (KeyError, TypeError, ValueError, OverflowError):
+        try:
+            return date_type(int(year), 1, 1)
+        except ValueError:
+            return date_type.min
+
+
+def encode_cursor(key):
+    day, year, rank = key
+    return base64.urlsafe_b64encode(f"{day.isoformat()}|{year}|{rank}".encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    day, year, rank = base64.urlsafe_b64decode(cursor.encode("ascii")).decode("utf-8").split("|", 2)
+    return (date_type.fromisoformat(day), year, int(rank))
+
+
+class ArticlesIndex:
+    """Every article keyed by (date, year, rank) and kept oldest first, so the newest article is
+    the last entry and adding one is normally an append.
+
+    Each year's list in the document is newest first (new articles go to the front), so an article's
+    rank counted from the end of its list never changes - keys, and cursors made from them, stay
+    valid as articles are added. The index follows the document's version: changes made here are
+    applied without a rebuild, anything else (another worker, an edit on disk) triggers one.
+
+    Only the index update is cheap - add() still goes through JsonDocument.update, which copies and
+    rewrites the whole of data/articles.json. Queries are not held up by that write: the index lock
+    is only taken to swap in the new lists."""
+
+    def __init__(self, document):
+        self.document = document
+        self._lock = threading.Lock()
+        self._add_lock = threading.Lock()
+        self._version = None
+        self._keys = []
+        self._articles = []
+        self.rebuilds = 0
+
+    def _rebuild(self, version, data):
+        entries = []
+        for year, articles in data.items():
+            for position, article in enumerate(articles):
+                entries.append(((article_date(article, year), year, len(articles) - 1 - position), article))
+        entries.sort(key=lambda entry: entry[0])
+        self._keys = [key for key, _ in entries]
+        self._articles = [article for _, article in entries]
+        self._version = version
+        self.rebuilds += 1
+
+    def _current(self):
+        version = self.document.snapshot()[0]
+        with self._lock:
+            if version != self._version:
+                self._rebuild(version, self.document.read())
+            return self._keys, self._articles
+
+    def add(self, year, article):
+        """Puts article at the front of year's list in the document and in the index.
+        Returns True if the year already existed."""
+        def add_article(json_file_loaded):
+            existed = year in json_file_loaded
+            json_file_loaded.setdefault(year, []).insert(0, article)
+            return existed, len(json_file_loaded[year]) - 1
+        with self._add_lock:
+            with self._lock:
+                previous_version = self._version if self._version == self.document.version else None
+            existed, rank = self.document.update(add_article)
+            with self._lock:
+                # Skipped if a query has already rebuilt from the new version (or another change came in)
+                if previous_version is not None and self._version == previous_version \
+                        and self.document.version == previous_version + 1:
+                    key = (article_date(article, year), year, rank)
+                    # New lists rather than inserting, as queries read the old ones without the lock
+                    position = len(self._keys) if not self._keys or key >= self._keys[-1] \
+                        else bisect_left(self._keys, key)
+                    self._keys = self._keys[:position] + [key] + self._keys[position:]
+                    self._articles = self._articles[:position] + [article] + self._articles[position:]
+                    self._version = self.document.version
+        return existed
+
+    def query(self, year=None, organization=None, since=None, limit=None, cursor=None):
+        """Newest first: {"Articles": [...], "NextCursor": ...}, NextCursor is None on the last page"""
+        keys, articles = self._current()
+        end = bisect_left(keys, decode_cursor(cursor)) if cursor else len(keys)
+        since_date = date_parser.parse(since).date() if since else None
+        organization = organization.lower() if organization else None
+        page = []
+        for position in range(end - 1, -1, -1):
+            key, article = keys[position], articles[position]
+            if since_date is not None and key[0] < since_date:
+                break
+            if year is not None and key[1] != year:
+                continue
+            if not isinstance(article, dict):
+                continue
+            if organization is not None and str(article.get("organization", "")).lower() != organization:
+                continue
+            if limit is not None and len(page) >= limit:
+                return {"Articles": page, "NextCursor": encode_cursor(keys[position + 1])}
+            page.append(article)
+        return {"Articles": page, "NextCursor": None}
+
+    def stats(self):
+        return {"Articles": len(self._keys), "Rebuilds": self.rebuilds}
@@ -0,0 +1,54 @@
+"""In-memory cache of the API .tokens file used for Basic auth"""
+import secrets
+import threading
+import time
+from document_store import JsonDocument
+
+
+class CredentialStore:
+    """Keeps .tokens in memory; /api/user_management changes it through document.update"""
+
+    def __init__(self, path):
+        self.path = path
+        self.document = JsonDocument(path)
+        self._lock = threading.Lock()
+        self.auth_count = 0
+        self.auth_seconds_total = 0.0
+        self.auth_seconds_max = 0.0
+
+    def tokens(self):
+        """Returns the cached tokens, reloaded if the file has been changed by another process"""
+        return self.document.read()
+
+    def check(self, username, password):
+        """Returns None if the credentials are valid, otherwise the reason they are not"""
+        started = time.perf_counter()
+        try:
+            user = self.tokens().get(username)
+            # Always run a comparison so unknown users take as long as known ones
+            expected = user["password"] if user else secrets.token_urlsafe(32)
+            is_correct_password = secrets.compare_digest(
+                password.encode("utf-8"), str(expected).encode("utf-8"))
+            if user is None or not is_correct_password:
+                return "Incorrect username or password"
+            if user.get("disabled") == "True":
+                return "Account Disabled"
+            return None
+        finally:
+            self._record(time.perf_counter() - started)
+
+    def _record(self, elapsed):
+        with self._lock:
+            self.auth_count += 1
+            self.auth_seconds_total += elapsed
+            self.auth_seconds_max = max(self.auth_seconds_max, elapsed)
+
+    def stats(self):
+        """Auth latency and reload counters for /api/metrics"""
+        with self._lock:
+            average = self.auth_seconds_total / self.auth_count if self.auth_count else 0.0
+            return {"Users": len(self.document.read()),
+                    "Reloads": self.document.reloads,
+                    "AuthCount": self.auth_count,
+                    "AuthAverageMs": round(average * 1000, 4),
+                    "AuthMaxMs": round(self.auth_seconds_max * 1000, 4)}
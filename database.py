@@ -0,0 +1,25 @@
+"""SQLite connection settings shared by the embedded stores"""
+import sqlite3
+from contextlib import contextmanager
+
+
+def connect(path):
+    """A connection in WAL mode so readers (and the export commands) never block the writer"""
+    connection = sqlite3.connect(path, check_same_thread=False, timeout=30, isolation_level=None)
+    connection.execute("PRAGMA journal_mode=WAL")
+    connection.execute("PRAGMA synchronous=NORMAL")
+    connection.execute("PRAGMA foreign_keys=ON")
+    return connection
+
+
+@contextmanager
+def transaction(connection, lock):
+    """BEGIN IMMEDIATE ... COMMIT under the store's lock, rolled back if anything fails"""
+    with lock:
+        connection.execute("BEGIN IMMEDIATE")
+        try:
+            yield connection
+        except BaseException:
+            connection.execute("ROLLBACK")
+            raise
+        connection.execute("COMMIT")
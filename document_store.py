@@ -0,0 +1,150 @@
+"""JSON files kept in memory, with writes serialised across threads and processes and replaced atomically"""
+import copy
+import hashlib
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from precompress import compress_bytes
+try:
+    import fcntl
+except ImportError:  # no cross-process locking without fcntl, the thread lock still applies
+    fcntl = None
+
+
+class JsonDocument:
+    """One JSON file. read() and content() serve the in-memory copy, checking the file for changes
+    made by other processes at most once per check_interval. update(fn) applies fn to a copy under
+    a writer lock and an flock on <file>.lock, then writes a temp file, fsyncs and renames it over."""
+
+    def __init__(self, path, check_interval=1.0, indent=4):
+        self.path = path
+        self.check_interval = check_interval
+        self.indent = indent
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._data = None
+        self._content = None
+        self._etag = None
+        self._encoded = {}
+        self._signature = None
+        self._checked = 0.0
+        self.version = 0
+        self.reloads = 0
+        self.writes = 0
+
+    def _file_signature(self):
+        stat_result = os.stat(self.path)
+        return (stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_size)
+
+    def _load(self, signature):
+        with open(self.path, 'rb') as fp:
+            content = fp.read()
+        self._data = json.loads(content)
+        self._set_content(content, signature)
+        self.reloads += 1
+
+    def _set_content(self, content, signature):
+        self._content = content
+        self._etag = f'"{hashlib.blake2b(content, digest_size=8).hexdigest()}"'
+        self._encoded = {}
+        self._signature = signature
+        self.version += 1
+
+    def _refresh(self, force=False):
+        now = time.monotonic()
+        if not force and self._data is not None and now - self._checked < self.check_interval:
+            return
+        signature = self._file_signature()
+        if signature != self._signature:
+            self._load(signature)
+        self._checked = now
+
+    def read(self):
+        """The parsed document - shared, so callers must not modify it (use update)"""
+        with self._lock:
+            self._refresh()
+            return self._data
+
+    def content(self):
+        """The document exactly as stored on disk"""
+        with self._lock:
+            self._refresh()
+            return self._content
+
+    def snapshot(self):
+        """(version, content, etag, mtime) read together, for building responses. The ETag is a
+        hash of the content so every worker process gives the same document the same tag."""
+        with self._lock:
+            self._refresh()
+            return self.version, self._content, self._etag, self._signature[0] / 1e9
+
+    def encoded(self, version, content, encoding):
+        """content (as returned by snapshot for version) compressed with encoding - made once per
+        version and kept until the document next changes"""
+        with self._lock:
+            cached = self._encoded.get(encoding) if version == self.version else None
+        if cached is not None:
+            return cached
+        compressed = compress_bytes(content, encoding)
+        with self._lock:
+            if version == self.version:
+                self._encoded[encoding] = compressed
+        return compressed
+
+    @contextmanager
+    def _file_lock(self):
+        if fcntl is None:
+            yield
+            return
+        with open(self.path + ".lock", 'a', encoding="utf-8") as lock_fp:
+            fcntl.flock(lock_fp, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_fp, fcntl.LOCK_UN)
+
+    def _write(self, content):
+        temp_path = f"{self.path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_path, 'wb') as fp:
+                fp.write(content)
+                fp.flush()
+                os.fsync(fp.fileno())
+            os.replace(temp_path, self.path)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        directory_fd = os.open(os.path.dirname(self.path) or ".", os.O_RDONLY)
+        try:
+            os.fsync(directory_fd)
+        finally:
+            os.close(directory_fd)
+
+    def update(self, fn):
+        """Runs fn(data) on a private copy of the latest document and persists the result.
+        Returns whatever fn returns; if fn raises or leaves the document unchanged, nothing is written.
+        Readers only wait for the in-memory swap, not for the flock and fsyncs."""
+        with self._write_lock, self._file_lock():
+            with self._lock:
+                self._refresh(force=True)
+                current = self._data
+            data = copy.deepcopy(current)
+            result = fn(data)
+            if data == current:
+                return result
+            content = json.dumps(data, indent=self.indent, separators=(',', ': ')).encode("utf-8")
+            self._write(content)
+            with self._lock:
+                signature = self._file_signature()
+                if signature != self._signature:  # a reader may already have loaded the new file
+                    self._data = data
+                    self._set_content(content, signature)
+                self._checked = time.monotonic()
+                self.writes += 1
+            return result
+
+    def stats(self):
+        return {"Version": self.version, "Reloads": self.reloads, "Writes": self.writes}
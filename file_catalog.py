@@ -0,0 +1,66 @@
+"""Sorted, cached listings of the data directories behind the availability endpoints"""
+import os
+import threading
+import time
+from bisect import bisect_left, bisect_right
+
+stats = {"Lookups": 0, "Rebuilds": 0}
+_catalogs = {}
+_catalogs_lock = threading.Lock()
+
+
+class FileCatalog:
+    """Listing of one directory (hidden entries skipped, sorted case-insensitively) that is only
+    rebuilt when the directory mtime changes - which it does whenever a file is added, removed or renamed"""
+
+    def __init__(self, directory, min_interval=1.0):
+        self.directory = directory
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._names = []
+        self._keys = []
+        self._mtime_ns = None
+        self._checked = 0.0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.min_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.min_interval:
+                return
+            mtime_ns = os.stat(self.directory).st_mtime_ns
+            if mtime_ns != self._mtime_ns:
+                names = sorted((f for f in os.listdir(self.directory) if not f.startswith(".")), key=str.lower)
+                self._names, self._keys = names, [name.lower() for name in names]
+                self._mtime_ns = mtime_ns
+                stats["Rebuilds"] += 1
+            self._checked = now
+
+    def listing(self, start=None, end=None, limit=None, offset=0):
+        """(total matching, page) for names between start and end inclusive. Both bounds are prefixes,
+        so from=2024-01-01&to=2024-01-31 covers 2024-01-31.json and to=2024-01 covers all of January."""
+        self._refresh()
+        stats["Lookups"] += 1
+        names, keys = self._names, self._keys
+        first = bisect_left(keys, start.lower()) if start else 0
+        last = bisect_right(keys, end.lower() + "\uffff") if end else len(names)
+        total = max(last - first, 0)
+        first += max(offset, 0)
+        if limit is not None:
+            last = min(last, first + max(limit, 0))
+        return total, names[first:last]
+
+
+def catalog(directory):
+    """The shared FileCatalog for a directory"""
+    found = _catalogs.get(directory)
+    if found is None:
+        with _catalogs_lock:
+            found = _catalogs.setdefault(directory, FileCatalog(directory))
+    return found
+
+
+def catalog_stats():
+    """Counters for /api/metrics"""
+    return {"Directories": len(_catalogs), **stats}
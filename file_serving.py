@@ -0,0 +1,329 @@
+"""Non-blocking file responses for the daily results and arrivals endpoints"""
+import os
+import secrets
+import zlib
+from email.utils import formatdate, parsedate_to_datetime
+from fastapi.responses import Response, StreamingResponse
+from starlette.concurrency import run_in_threadpool
+from precompress import available_encodings, is_current_variant, variant_path
+from arrivals_filter import read_csv_header, iter_filtered_csv
+
+CHUNK_SIZE = 64 * 1024
+MAX_RANGES = 16
+
+
+def _read_file(path):
+    with open(path, 'rb') as fp:
+        return fp.read()
+
+
+async def read_file(path):
+    """Reads a whole file in the threadpool so the event loop never waits on disk"""
+    return await run_in_threadpool(_read_file, path)
+
+
+async def iter_file(path, start=0, length=None, chunk_size=CHUNK_SIZE):
+    """Yields a file (or a byte range of it) in bounded chunks read off the event loop"""
+    fp = await run_in_threadpool(open, path, 'rb')
+    try:
+        if start:
+            await run_in_threadpool(fp.seek, start)
+        remaining = length
+        while remaining is None or remaining > 0:
+            size = chunk_size if remaining is None else min(chunk_size, remaining)
+            chunk = await run_in_threadpool(fp.read, size)
+            if not chunk:
+                break
+            if remaining is not None:
+                remaining -= len(chunk)
+            yield chunk
+    finally:
+        fp.close()
+
+
+def make_etag(stat_result):
+    """Strong validator built from size, mtime and inode"""
+    return f'"{stat_result.st_size:x}-{stat_result.st_mtime_ns:x}-{stat_result.st_ino:x}"'
+
+
+def validator_headers(stat_result):
+    """ETag and Last-Modified for a file"""
+    return {"ETag": make_etag(stat_result),
+            "Last-Modified": formatdate(stat_result.st_mtime, usegmt=True)}
+
+
+def is_not_modified(request, etag, mtime):
+    """True when the request's If-None-Match / If-Modified-Since say the client copy is current"""
+    if request is None or request.method not in ("GET", "HEAD"):
+        return False
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        if if_none_match.strip() == "*":
+            return True
+        tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+        return etag.removeprefix("W/") in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
+
+NOT_MODIFIED_HEADERS = ("ETag", "Last-Modified", "Vary", "Cache-Control")
+
+
+def not_modified_response(headers):
+    """304 carrying the same validators a 200 would have (but no content headers)"""
+    return Response(status_code=304, headers={
+        name: value for name, value in headers.items() if name in NOT_MODIFIED_HEADERS})
+
+
+def parse_range_header(range_header, size):
+    """Turns a Range header into sorted, merged (start, end) inclusive byte ranges.
+    Returns None when the header should be ignored and [] when nothing in it is satisfiable."""
+    units, _, range_set = range_header.partition("=")
+    if units.strip().lower() != "bytes":
+        return None
+    ranges = []
+    for part in range_set.split(","):
+        start_text, separator, end_text = part.strip().partition("-")
+        if not separator:
+            return None
+        try:
+            if start_text == "":
+                suffix_length = int(end_text)
+                if suffix_length == 0:
+                    continue
+                start, end = max(size - suffix_length, 0), size - 1
+            else:
+                start = int(start_text)
+                end = int(end_text) if end_text else size - 1
+                if end_text and end < start:
+                    return None
+                end = min(end, size - 1)
+        except ValueError:
+            return None
+        if start < size:
+            ranges.append((start, end))
+    ranges.sort()
+    merged = []
+    for start, end in ranges:
+        if merged and start <= merged[-1][1] + 1:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    if len(merged) > MAX_RANGES:
+        return None
+    return merged
+
+
+def _if_range_matches(request, etag, last_modified):
+    if_range = request.headers.get("if-range")
+    return if_range is None or if_range.strip() in (etag, last_modified)
+
+
+async def _iter_multipart(path, ranges, size, media_type, boundary):
+    for start, end in ranges:
+        yield (f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+               f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n").encode("latin-1")
+        async for chunk in iter_file(path, start, end - start + 1):
+            yield chunk
+        yield b"\r\n"
+    yield f"--{boundary}--\r\n".encode("latin-1")
+
+
+def range_response(request, path, size, media_type, headers):
+    """206/416 response for a Range request, or None to send the whole file"""
+    range_header = request.headers.get("range") if request is not None else None
+    if not range_header or request.method != "GET":
+        return None
+    if not _if_range_matches(request, headers["ETag"], headers["Last-Modified"]):
+        return None
+    ranges = parse_range_header(range_header, size)
+    if ranges is None:
+        return None
+    if not ranges:
+        headers["Content-Range"] = f"bytes */{size}"
+        return Response(status_code=416, headers=headers)
+    if len(ranges) == 1:
+        start, end = ranges[0]
+        headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+        headers["Content-Length"] = str(end - start + 1)
+        return StreamingResponse(iter_file(path, start, end - start + 1), status_code=206,
+                                 media_type=media_type, headers=headers)
+    boundary = secrets.token_hex(12)
+    content_length = len(f"--{boundary}--\r\n")
+    for start, end in ranges:
+        content_length += len(f"--{boundary}\r\nContent-Type: {media_type}\r\n"
+                              f"Content-Range: bytes {start}-{end}/{size}\r\n\r\n")
+        content_length += end - start + 1 + 2
+    headers["Content-Length"] = str(content_length)
+    return StreamingResponse(_iter_multipart(path, ranges, size, media_type, boundary), status_code=206,
+                             media_type=f"multipart/byteranges; boundary={boundary}", headers=headers)
+
+
+def accepted_encodings(request):
+    """Accept-Encoding as {coding: q}"""
+    accepted = {}
+    for item in request.headers.get("accept-encoding", "").split(","):
+        coding, _, params = item.partition(";")
+        coding = coding.strip().lower()
+        if not coding:
+            continue
+        quality = 1.0
+        for param in params.split(";"):
+            name, _, value = param.strip().partition("=")
+            if name.lower() == "q":
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        accepted[coding] = quality
+    return accepted
+
+
+def negotiate_encodings(request, encodings):
+    """The encodings from our preference-ordered list that the client accepts, best first"""
+    if request is None:
+        return []
+    accepted = accepted_encodings(request)
+    ranked = []
+    for preference, encoding in enumerate(encodings):
+        quality = accepted.get(encoding, accepted.get("*", 0.0))
+        if quality > 0:
+            ranked.append((-quality, preference, encoding))
+    return [encoding for _, _, encoding in sorted(ranked)]
+
+
+def variant_etag(etag, encoding):
+    """Each encoding is a different representation so it needs its own strong ETag"""
+    return f'{etag[:-1]}-{encoding}"'
+
+
+def _find_variant(path, path_stat, encodings):
+    for encoding in encodings:
+        try:
+            variant_stat = os.stat(variant_path(path, encoding))
+        except FileNotFoundError:
+            continue
+        if is_current_variant(path_stat, variant_stat):
+            return encoding, variant_stat
+    return None
+
+
+async def iter_gzip(path):
+    """Compresses the file on the fly for files that have no precompressed copy yet"""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    async for chunk in iter_file(path):
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _set_encoding(headers, encoding):
+    headers["Content-Encoding"] = encoding
+    headers["ETag"] = variant_etag(headers["ETag"], encoding)
+
+
+async def _serve_cached(request, path, entry, cache, media_type, headers):
+    headers["Vary"] = "Accept-Encoding"
+    content = entry.content
+    encodings = negotiate_encodings(request, available_encodings())
+    if encodings:
+        content = await cache.encoded(path, entry, encodings[0])
+        _set_encoding(headers, encodings[0])
+    if is_not_modified(request, headers["ETag"], entry.stat_result.st_mtime):
+        return not_modified_response(headers)
+    return Response(content=content, media_type=media_type, headers=headers)
+
+
+async def _serve_stream(request, path, stat_result, media_type, headers):
+    headers["Vary"] = "Accept-Encoding"
+    headers["Accept-Ranges"] = "bytes"
+    # Ranges always refer to the identity bytes, so only compress whole-file downloads
+    if request is not None and "range" not in request.headers:
+        encodings = negotiate_encodings(request, available_encodings())
+        variant = await run_in_threadpool(_find_variant, path, stat_result, encodings) if encodings else None
+        if variant is not None:
+            encoding, variant_stat = variant
+            _set_encoding(headers, encoding)
+            if is_not_modified(request, headers["ETag"], stat_result.st_mtime):
+                return not_modified_response(headers)
+            headers["Content-Length"] = str(variant_stat.st_size)
+            return StreamingResponse(iter_file(variant_path(path, encoding), length=variant_stat.st_size),
+                                     media_type=media_type, headers=headers)
+        if "gzip" in encodings:
+            _set_encoding(headers, "gzip")
+            # Not byte-identical to the level 9 precompressed .gz that shares its variant tag
+            headers["ETag"] = f"W/{headers['ETag']}"
+            if is_not_modified(request, headers["ETag"], stat_result.st_mtime):
+                return not_modified_response(headers)
+            return StreamingResponse(iter_gzip(path), media_type=media_type, headers=headers)
+    if is_not_modified(request, headers["ETag"], stat_result.st_mtime):
+        return not_modified_response(headers)
+    partial = range_response(request, path, stat_result.st_size, media_type, headers)
+    if partial is not None:
+        return partial
+    headers["Content-Length"] = str(stat_result.st_size)
+    # Today's CSV is still being appended to, so never send more than Content-Length promised
+    return StreamingResponse(iter_file(path, length=stat_result.st_size), media_type=media_type, headers=headers)
+
+
+async def serve_file(request, path, media_type, headers=None, stream=False, cache=None, immutable=False):
+    """Returns the file as a Response, or a StreamingResponse when stream is set.
+    Answers conditional GETs with a 304 when the client already has the current copy.
+    Cached and streamed files are content-negotiated (precompressed copy, then on-the-fly gzip),
+    and streamed files answer byte Range requests with a 206.
+    Raises FileNotFoundError before anything is sent so callers can fall back to their error page."""
+    response_headers = dict(headers or {})
+    if cache is not None:
+        entry = await cache.get(path, immutable=immutable)
+        response_headers.update(validator_headers(entry.stat_result))
+        return await _serve_cached(request, path, entry, cache, media_type, response_headers)
+    stat_result = await run_in_threadpool(os.stat, path)
+    response_headers.update(validator_headers(stat_result))
+    if stream:
+        return await _serve_stream(request, path, stat_result, media_type, response_headers)
+    if is_not_modified(request, response_headers["ETag"], stat_result.st_mtime):
+        return not_modified_response(response_headers)
+    return Response(content=await read_file(path), media_type=media_type, headers=response_headers)
+
+
+async def serve_json_file(request, path, cache=None, immutable=False):
+    """Shortcut for the JSON documents"""
+    return await serve_file(request, path, "application/json", cache=cache, immutable=immutable)
+
+
+async def serve_filtered_csv(request, path, headers, arrivals_filter):
+    """Streams only the requested columns and rows of a CSV, in a single pass over the file"""
+    stat_result = await run_in_threadpool(os.stat, path)
+    resolved = arrivals_filter.resolve(await run_in_threadpool(read_csv_header, path))
+    headers.update(validator_headers(stat_result))
+    headers["ETag"] = variant_etag(headers["ETag"], arrivals_filter.cache_key())
+    if is_not_modified(request, headers["ETag"], stat_result.st_mtime):
+        return not_modified_response(headers)
+    return StreamingResponse(iter_filtered_csv(path, resolved), media_type="text/csv", headers=headers)
+
+
+async def serve_csv_file(request, path, filename, arrivals_filter=None):
+    """Shortcut for the arrivals CSV downloads, optionally projected/filtered"""
+    headers = {"Content-Disposition": f"attachment; filename={filename}"}
+    if arrivals_filter is not None and not arrivals_filter.is_empty:
+        return await serve_filtered_csv(request, path, headers, arrivals_filter)
+    return await serve_file(request, path, "text/csv", stream=True, headers=headers)
+
+
+async def serve_document(request, document, status_code=200):
+    """A JsonDocument straight from memory, compressed variants made once per version"""
+    version, content, etag, mtime = document.snapshot()
+    headers = {"ETag": etag, "Last-Modified": formatdate(mtime, usegmt=True), "Vary": "Accept-Encoding"}
+    encodings = negotiate_encodings(request, available_encodings())
+    if encodings:
+        content = await run_in_threadpool(document.encoded, version, content, encodings[0])
+        _set_encoding(headers, encodings[0])
+    if status_code == 200 and is_not_modified(request, headers["ETag"], mtime):
+        return not_modified_response(headers)
+    return Response(content=content, media_type="application/json", headers=headers, status_code=status_code)
@@ -0,0 +1,26 @@
+"""Heavy libraries imported on first use instead of when the API starts"""
+import importlib
+import importlib.util
+
+
+class LazyModule:
+    """Stands in for a module until an attribute is first read, then imports it"""
+
+    def __init__(self, name):
+        self._name = name
+
+    def __getattr__(self, attribute):
+        module = importlib.import_module(self._name)
+        self.__dict__.update(module.__dict__)
+        return getattr(module, attribute)
+
+    def __repr__(self):
+        return f"<lazy module {self._name!r}>"
+
+
+def lazy_import(name, optional=False):
+    """A LazyModule for name. With optional=True, None if the package is not installed -
+    checked without importing it, so `if module is None` keeps working like a try/except import."""
+    if optional and importlib.util.find_spec(name.partition(".")[0]) is None:
+        return None
+    return LazyModule(name)
@@ -0,0 +1,127 @@
+"""Writes gzip/brotli/zstd copies of finished arrivals files so they are never recompressed per request"""
+import gzip
+import os
+import shutil
+import sys
+import threading
+from datetime import datetime, timedelta
+try:
+    import brotli
+except ImportError:  # brotli is optional, gzip is always available
+    brotli = None
+try:
+    import zstandard
+except ImportError:  # zstandard is optional, gzip is always available
+    zstandard = None
+
+PRECOMPRESSED_DIRECTORY = ".precompressed"
+ENCODING_SUFFIXES = {"br": ".br", "zstd": ".zst", "gzip": ".gz"}
+
+stats = {"FilesWritten": 0, "BytesIn": 0, "BytesOut": 0, "Errors": 0}
+_stats_lock = threading.Lock()
+
+
+def available_encodings():
+    """Encodings we can produce, in order of preference"""
+    encodings = []
+    if brotli is not None:
+        encodings.append("br")
+    if zstandard is not None:
+        encodings.append("zstd")
+    encodings.append("gzip")
+    return encodings
+
+
+def variant_path(path, encoding):
+    """Where the compressed copy of path lives - a hidden folder so availability listings skip it"""
+    directory, filename = os.path.split(path)
+    return os.path.join(directory, PRECOMPRESSED_DIRECTORY, filename + ENCODING_SUFFIXES[encoding])
+
+
+def compress_bytes(content, encoding):
+    """One-shot compression for content already in memory. This runs while a request waits, so it
+    uses fast levels - the high levels are kept for the offline precompress job."""
+    if encoding == "br":
+        return brotli.compress(content, quality=5)
+    if encoding == "zstd":
+        return zstandard.ZstdCompressor(level=3).compress(content)
+    return gzip.compress(content, compresslevel=6, mtime=0)
+
+
+def _compress_stream(source_fp, target_fp, encoding):
+    if encoding == "br":
+        compressor = brotli.Compressor(quality=9)
+        while chunk := source_fp.read(1024 * 1024):
+            target_fp.write(compressor.process(chunk))
+        target_fp.write(compressor.finish())
+    elif encoding == "zstd":
+        zstandard.ZstdCompressor(level=19).copy_stream(source_fp, target_fp)
+    else:
+        with gzip.GzipFile(fileobj=target_fp, mode='wb', compresslevel=9, mtime=0) as gzip_fp:
+            shutil.copyfileobj(source_fp, gzip_fp, 1024 * 1024)
+
+
+def compress_file(path, encoding):
+    """Writes the compressed copy of path, stamped with the source mtime so stale copies can be spotted"""
+    target = variant_path(path, encoding)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    source_stat = os.stat(path)
+    temp_target = f"{target}.{os.getpid()}.tmp"
+    try:
+        with open(path, 'rb') as source_fp, open(temp_target, 'wb') as target_fp:
+            _compress_stream(source_fp, target_fp, encoding)
+        os.utime(temp_target, ns=(source_stat.st_atime_ns, source_stat.st_mtime_ns))
+        os.replace(temp_target, target)
+    except BaseException:
+        if os.path.exists(temp_target):
+            os.remove(temp_target)
+        raise
+    with _stats_lock:
+        stats["FilesWritten"] += 1
+        stats["BytesIn"] += source_stat.st_size
+        stats["BytesOut"] += os.stat(target).st_size
+
+
+def is_current_variant(path_stat, variant_stat):
+    """A compressed copy is only usable if it was made from this exact version of the source"""
+    return variant_stat.st_mtime_ns == path_stat.st_mtime_ns
+
+
+def precompress_directory(directory, cutoff):
+    """Compresses every file whose name (a date or month) sorts before cutoff and is missing a current copy"""
+    try:
+        filenames = os.listdir(directory)
+    except FileNotFoundError:
+        return
+    for filename in filenames:
+        path = os.path.join(directory, filename)
+        if filename.startswith(".") or os.path.splitext(filename)[0] >= cutoff or not os.path.isfile(path):
+            continue
+        path_stat = os.stat(path)
+        for encoding in available_encodings():
+            try:
+                if is_current_variant(path_stat, os.stat(variant_path(path, encoding))):
+                    continue
+            except FileNotFoundError:
+                pass
+            try:
+                compress_file(path, encoding)
+            except OSError:
+                with _stats_lock:
+                    stats["Errors"] += 1
+
+
+def precompress_arrivals(main_file_path):
+    """Compresses finished daily (before yesterday) and monthly (before last month) arrivals CSVs"""
+    yesterday = datetime.strftime(datetime.now() - timedelta(days=1), "%Y-%m-%d")
+    last_month = datetime.strftime(datetime.now().replace(day=1) - timedelta(days=1), "%Y-%m")
+    for agency in ("cta", "metra"):
+        precompress_directory(main_file_path + "train_arrivals/csv/" + agency + "/", yesterday)
+        precompress_directory(main_file_path + "train_arrivals/csv_month/" + agency + "/", last_month)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    precompress_arrivals(sys.argv[1] if len(sys.argv) > 1 else os.getenv('FILE_PATH'))
+    print(stats)
@@ -1,4 +1,5 @@
 #!/bin/sh
+# The reload needs ExecReload in the unit (see api-service.service); without it this restarts instead
 cd $(dirname $0)
 python3 -m pip install --upgrade pip
 sudo git stash
@@ -7,4 +8,4 @@ sudo git pull
 sudo chown -R brandonmcfadden:brandonmcfadden .
 sudo chmod +x production-upgrade.sh
 pip install -r /home/brandonmcfadden/my-api/requirements.txt
-sudo systemctl restart api-service.service
\ No newline at end of file
+sudo systemctl reload api-service.service || sudo systemctl restart api-service.service
\ No newline at end of file
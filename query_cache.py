@@ -0,0 +1,203 @@
+"""On-disk cache of arrivals range query results, with identical concurrent queries coalesced"""
+import asyncio
+import hashlib
+import os
+import threading
+import time
+from starlette.concurrency import run_in_threadpool
+from starlette.responses import StreamingResponse
+
+
+class QueryResultCache:
+    """CSV results stored as <key>.closed.csv (window ends before yesterday, kept until evicted)
+    or <key>.open.csv (window reaches yesterday or today, only served for open_ttl seconds).
+
+    Each worker process has its own instance over the same directory: results and the max_bytes
+    budget are shared, but identical queries are only coalesced within one worker (and the
+    counters in stats() are per worker)."""
+
+    def __init__(self, directory, max_bytes, open_ttl=300):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.open_ttl = open_ttl
+        self._lock = threading.Lock()
+        self._index = {}
+        self._inflight = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.bytes_saved = 0
+        self.evictions = 0
+        self._load_index()
+
+    def _load_index(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._index = self._scan()
+
+    def _scan(self):
+        entries = {}
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".csv"):
+                try:
+                    stat_result = os.stat(os.path.join(self.directory, filename))
+                except FileNotFoundError:  # evicted by another worker
+                    continue
+                entries[filename] = [stat_result.st_size, stat_result.st_mtime]
+        return entries
+
+    @staticmethod
+    def make_key(agency, startdate, enddate, arrivals_filter):
+        """Normalised query -> cache key"""
+        text = "|".join((agency, startdate.replace(" ", "T"), enddate.replace(" ", "T"),
+                         arrivals_filter.cache_key() if arrivals_filter is not None else ""))
+        return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def is_closed(enddate, yesterday):
+        """A window is closed when it ends at or before the start of yesterday - yesterday's
+        arrivals are not loaded until about 01:00, so a window covering it can still change"""
+        return enddate.replace(" ", "T") <= yesterday
+
+    def _filename(self, key, closed):
+        return f"{key}.{'closed' if closed else 'open'}.csv"
+
+    def _lookup(self, key, closed):
+        filename = self._filename(key, closed)
+        path = os.path.join(self.directory, filename)
+        try:
+            stat_result = os.stat(path)
+        except FileNotFoundError:
+            return None
+        if not closed and time.time() - stat_result.st_mtime > self.open_ttl:
+            return None
+        with self._lock:
+            self.hits += 1
+            self.bytes_saved += stat_result.st_size
+            self._index[filename] = [stat_result.st_size, time.time()]
+        return path
+
+    async def lookup(self, key, closed):
+        """Path of a usable cached result, or None"""
+        path = await run_in_threadpool(self._lookup, key, closed)
+        if path is None:
+            with self._lock:
+                self.misses += 1
+        return path
+
+    async def wait_for(self, key, timeout=600):
+        """If the same query is already running, waits for it and returns True when it was cached.
+        Returns None when there was nothing to wait for (or it took too long)."""
+        future = self._inflight.get(key)
+        if future is None:
+            return None
+        with self._lock:
+            self.coalesced += 1
+        try:
+            return await asyncio.wait_for(asyncio.shield(future), timeout)
+        except asyncio.TimeoutError:
+            return None
+
+    def begin(self, key):
+        """Marks a query as running so identical requests wait for it - call without awaiting
+        anything after wait_for returns, then always end with response() or finish().
+        Returns the in-flight marker to pass to them."""
+        future = self._inflight[key] = asyncio.get_running_loop().create_future()
+        return future
+
+    def finish(self, key, completed, future):
+        """Resolves future and drops it from the in-flight table (if a later query has not replaced it)"""
+        if self._inflight.get(key) is future:
+            del self._inflight[key]
+        if not future.done():
+            future.set_result(completed)
+
+    def response(self, key, closed, future, chunks, on_failure=None, **kwargs):
+        """A StreamingResponse of chunks that also writes them to the cache. The in-flight marker is
+        resolved when the response ends, even if the body was never started (client gone), and
+        on_failure() is called if the body was not sent in full."""
+        def on_close():
+            self.finish(key, False, future)
+            if on_failure is not None and not future.result():
+                on_failure()
+        return _ResolvingStreamingResponse(self.tee(key, closed, future, chunks), on_close, **kwargs)
+
+    async def tee(self, key, closed, future, chunks):
+        """Passes chunks through while writing them to the cache; requests waiting in
+        wait_for read the file once it is complete"""
+        filename = self._filename(key, closed)
+        path = os.path.join(self.directory, filename)
+        temp_path = f"{path}.{os.getpid()}.{id(chunks)}.tmp"
+        completed = False
+        fp = await run_in_threadpool(open, temp_path, 'wb')
+        try:
+            async for chunk in chunks:
+                await run_in_threadpool(fp.write, chunk)
+                yield chunk
+            completed = True
+        finally:
+            try:
+                await run_in_threadpool(self._store, fp, temp_path, filename, completed)
+            finally:
+                self.finish(key, completed, future)
+
+    def _store(self, fp, temp_path, filename, completed):
+        """Closes a tee's temp file and moves it into place (then evicts), or discards it"""
+        fp.close()
+        if completed:
+            path = os.path.join(self.directory, filename)
+            os.replace(temp_path, path)
+            with self._lock:
+                self._index[filename] = [os.stat(path).st_size, time.time()]
+            self._evict()
+        elif os.path.exists(temp_path):
+            os.remove(temp_path)
+
+    def _evict(self):
+        """Trims the directory back to max_bytes, least recently used first. The directory is shared
+        by every worker, so it is rescanned to count their results too (last use is only known for
+        this worker's hits, others count from when the file was written)."""
+        entries = self._scan()
+        with self._lock:
+            for filename, entry in entries.items():
+                if filename in self._index:
+                    entry[1] = max(entry[1], self._index[filename][1])
+            self._index = entries
+            total = sum(size for size, _ in self._index.values())
+            for filename, (size, _) in sorted(self._index.items(), key=lambda item: item[1][1]):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except FileNotFoundError:
+                    pass
+                del self._index[filename]
+                total -= size
+                self.evictions += 1
+
+    def stats(self):
+        """Counters for /api/metrics"""
+        with self._lock:
+            requests = self.hits + self.misses
+            return {"Entries": len(self._index),
+                    "Bytes": sum(size for size, _ in self._index.values()),
+                    "MaxBytes": self.max_bytes,
+                    "Hits": self.hits,
+                    "Misses": self.misses,
+                    "HitRate": round(self.hits / requests, 4) if requests else 0.0,
+                    "Coalesced": self.coalesced,
+                    "BytesSaved": self.bytes_saved,
+                    "Evictions": self.evictions}
+
+
+class _ResolvingStreamingResponse(StreamingResponse):
+    """Runs on_close once the response is over, however it ended"""
+
+    def __init__(self, content, on_close, **kwargs):
+        super().__init__(content, **kwargs)
+        self.on_close = on_close
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            self.on_close()
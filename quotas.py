@@ -0,0 +1,196 @@
+"""Daily byte and query budgets per API user, with the tier read from the user's .tokens record"""
+import threading
+from datetime import datetime, timedelta
+from fastapi import HTTPException
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+from database import connect, transaction
+
+GIB = 1024 * 1024 * 1024
+
+# Budgets per tier, None meaning unlimited. A .tokens record picks its tier with "tier" and can
+# override either budget with "daily_bytes" / "daily_queries".
+QUOTA_TIERS = {
+    "basic": {"DailyBytes": 1 * GIB, "DailyQueries": 50},
+    "standard": {"DailyBytes": 10 * GIB, "DailyQueries": 500},
+    "unlimited": {"DailyBytes": None, "DailyQueries": None},
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS usage (
+    day TEXT NOT NULL,
+    username TEXT NOT NULL,
+    bytes INTEGER NOT NULL DEFAULT 0,
+    queries INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (day, username)
+);
+"""
+
+
+def _today():
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+def _seconds_until_reset():
+    now = datetime.now()
+    midnight = datetime.combine(now.date() + timedelta(days=1), datetime.min.time())
+    return int((midnight - now).total_seconds()) + 1
+
+
+def _budget(record, field, default):
+    value = record.get(field, default)
+    return None if value in (None, "", "None") else int(value)
+
+
+class Quotas:
+    """Usage is counted in memory and flush()ed to SQLite every second or so by a background job,
+    which also reads back every worker's totals for the day - so checks never touch the disk and
+    all workers agree on usage to within one flush."""
+
+    def __init__(self, path, credential_store, default_tier="standard"):
+        self.path = path
+        self.credential_store = credential_store
+        self.default_tier = default_tier
+        self._lock = threading.Lock()
+        self._connection_lock = threading.Lock()
+        self.connection = connect(path)
+        self.connection.executescript(SCHEMA)
+        self._day = _today()
+        self._pending = {}
+        self._flushing = {}
+        self.rejected = 0
+        self._totals = self._read_totals(self._day)
+
+    def limits(self, username):
+        """(tier, daily bytes, daily queries) for a user"""
+        record = self.credential_store.tokens().get(username) or {}
+        tier = record.get("tier") or self.default_tier
+        budgets = QUOTA_TIERS.get(tier, QUOTA_TIERS[self.default_tier])
+        return (tier, _budget(record, "daily_bytes", budgets["DailyBytes"]),
+                _budget(record, "daily_queries", budgets["DailyQueries"]))
+
+    def _roll_over(self):
+        day = _today()
+        if day != self._day:
+            self._day = day
+            self._totals = {}
+
+    def usage(self, username):
+        """(bytes, queries) used today"""
+        with self._lock:
+            self._roll_over()
+            total = self._totals.get(username, (0, 0))
+            pending = self._pending.get((self._day, username), (0, 0))
+            flushing = self._flushing.get((self._day, username), (0, 0))
+        return total[0] + pending[0] + flushing[0], total[1] + pending[1] + flushing[1]
+
+    def _add(self, username, count_bytes, queries):
+        with self._lock:
+            self._roll_over()
+            key = (self._day, username)
+            pending = self._pending.get(key, (0, 0))
+            self._pending[key] = (pending[0] + count_bytes, pending[1] + queries)
+
+    def _reject(self, username, detail):
+        self.rejected += 1
+        raise HTTPException(HTTP_429_TOO_MANY_REQUESTS, detail,
+                            headers={"Retry-After": str(_seconds_until_reset()), **self.headers(username)})
+
+    def check(self, username):
+        """Raises 429 if the user has already used up either daily budget"""
+        _, byte_budget, query_budget = self.limits(username)
+        used_bytes, used_queries = self.usage(username)
+        if byte_budget is not None and used_bytes >= byte_budget:
+            self._reject(username, "Daily Byte Quota Exceeded")
+        if query_budget is not None and used_queries >= query_budget:
+            self._reject(username, "Daily Query Quota Exceeded")
+
+    def charge_queries(self, username, units):
+        """Takes units from the user's query budget, raising 429 (and taking nothing) if they do not
+        fit. A negative units refunds a charge for work that was not done."""
+        _, _, query_budget = self.limits(username)
+        if units > 0 and query_budget is not None and self.usage(username)[1] + units > query_budget:
+            self._reject(username, "Daily Query Quota Exceeded")
+        self._add(username, 0, units)
+
+    def add_bytes(self, username, count_bytes):
+        if count_bytes:
+            self._add(username, count_bytes, 0)
+
+    def headers(self, username):
+        """Usage headers as of the start of the response (bytes it sends count afterwards)"""
+        tier, byte_budget, query_budget = self.limits(username)
+        used_bytes, used_queries = self.usage(username)
+        return {"X-Quota-Tier": tier,
+                "X-Quota-Bytes-Limit": "unlimited" if byte_budget is None else str(byte_budget),
+                "X-Quota-Bytes-Used": str(used_bytes),
+                "X-Quota-Queries-Limit": "unlimited" if query_budget is None else str(query_budget),
+                "X-Quota-Queries-Used": str(used_queries),
+                "X-Quota-Reset": str(_seconds_until_reset())}
+
+    def _read_totals(self, day):
+        with self._connection_lock:
+            rows = self.connection.execute(
+                "SELECT username, bytes, queries FROM usage WHERE day = ?", (day,)).fetchall()
+        return {username: (count_bytes, queries) for username, count_bytes, queries in rows}
+
+    def flush(self):
+        """Adds the pending counts to the usage table and refreshes today's totals from it"""
+        with self._lock:
+            pending = self._flushing = self._pending
+            self._pending = {}
+        try:
+            if pending:
+                with transaction(self.connection, self._connection_lock) as connection:
+                    connection.executemany(
+                        "INSERT INTO usage (day, username, bytes, queries) VALUES (?, ?, ?, ?) "
+                        "ON CONFLICT (day, username) DO UPDATE SET "
+                        "bytes = bytes + excluded.bytes, queries = queries + excluded.queries",
+                        [(day, username, count_bytes, queries)
+                         for (day, username), (count_bytes, queries) in pending.items()])
+        except BaseException:
+            with self._lock:
+                for key, (count_bytes, queries) in pending.items():
+                    current = self._pending.get(key, (0, 0))
+                    self._pending[key] = (current[0] + count_bytes, current[1] + queries)
+                self._flushing = {}
+            raise
+        day = _today()
+        totals = self._read_totals(day)
+        with self._lock:
+            self._roll_over()
+            if day == self._day:
+                self._totals = totals
+            self._flushing = {}
+
+    def stats(self):
+        with self._lock:
+            return {"Users": len(self._totals), "Pending": len(self._pending), "Rejected": self.rejected}
+
+
+class QuotaMiddleware:
+    """Counts the response bytes of requests made by a quota'd user (set in scope state by the auth
+    dependency as "quota_user") and adds the usage headers to their responses"""
+
+    def __init__(self, app, quotas):
+        self.app = app
+        self.quotas = quotas
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        state = scope.setdefault("state", {})
+
+        async def send_counted(message):
+            username = state.get("quota_user")
+            if username is not None:
+                if message["type"] == "http.response.start":
+                    headers = [(name.lower().encode("latin-1"), value.encode("latin-1"))
+                               for name, value in self.quotas.headers(username).items()]
+                    existing = {name for name, _ in message.get("headers", [])}
+                    message["headers"] = list(message.get("headers", [])) + \
+                        [header for header in headers if header[0] not in existing]
+                elif message["type"] == "http.response.body":
+                    self.quotas.add_bytes(username, len(message.get("body", b"")))
+            await send(message)
+        await self.app(scope, receive, send_counted)
@@ -0,0 +1,178 @@
+"""Rate limiting decided in-process with token buckets, with usage reconciled across workers through Redis"""
+import asyncio
+import logging
+import time
+from math import ceil
+from fastapi import HTTPException
+from starlette.requests import Request
+from starlette.responses import Response
+from starlette.status import HTTP_429_TOO_MANY_REQUESTS
+import redis.asyncio as redis
+
+
+class _Bucket:
+    __slots__ = ("tokens", "updated", "window", "count", "pending", "others")
+
+    def __init__(self, times, now):
+        self.tokens = float(times)
+        self.updated = now
+        self.window = None
+        self.count = 0
+        self.pending = 0
+        self.others = 0
+
+
+class RateLimits:
+    """Token buckets for every (client, path) seen by this worker.
+
+    allow() never waits on the network. Each request taken from a bucket is also counted against a
+    fixed window shared by all workers (wall-clock time // period); sync() pushes those counts to
+    Redis in one pipeline and reads back the totals, so a worker also refuses requests once the other
+    workers have used up the window. While Redis is unreachable the buckets alone decide, and sync()
+    retries the connection every retry_interval."""
+
+    def __init__(self, prefix="rate-limit", sync_interval=0.2, retry_interval=5.0, timeout=0.5, idle_seconds=300):
+        self.prefix = prefix
+        self.sync_interval = sync_interval
+        self.retry_interval = retry_interval
+        self.timeout = timeout
+        self.idle_seconds = idle_seconds
+        self.redis = None
+        self.remote_ok = False
+        self._buckets = {}
+        self._periods = {}
+        self._dirty = set()
+        self._retry_at = 0.0
+        self._pruned = time.monotonic()
+        self.allowed = 0
+        self.limited = 0
+        self.syncs = 0
+        self.sync_failures = 0
+
+    def connect(self, url, max_connections=4):
+        """Uses a small connection pool for the sync pipeline; the first sync checks the connection"""
+        self.redis = redis.from_url(url, max_connections=max_connections, socket_timeout=self.timeout,
+                                    socket_connect_timeout=self.timeout)
+
+    def allow(self, key, times, period):
+        """0 if the request may go ahead, otherwise the seconds to wait before retrying"""
+        now = time.monotonic()
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets[key] = _Bucket(times, now)
+            self._periods[key] = period
+        else:
+            bucket.tokens = min(times, bucket.tokens + (now - bucket.updated) * times / period)
+            bucket.updated = now
+        clock = time.time()
+        window = int(clock // period)
+        if window != bucket.window:
+            bucket.window = window
+            bucket.count = bucket.pending = bucket.others = 0
+        if bucket.tokens < 1:
+            self.limited += 1
+            return (1 - bucket.tokens) * period / times
+        if self.remote_ok and bucket.count + bucket.others >= times:
+            self.limited += 1
+            return (window + 1) * period - clock
+        bucket.tokens -= 1
+        bucket.count += 1
+        bucket.pending += 1
+        self._dirty.add(key)
+        self.allowed += 1
+        return 0
+
+    async def sync(self):
+        """Sends this worker's new counts to Redis and learns how much of each window the others used"""
+        if self.redis is None:
+            return
+        now = time.monotonic()
+        if now - self._pruned > self.idle_seconds:
+            self._prune(now)
+        if not self.remote_ok and now < self._retry_at:
+            return
+        dirty, self._dirty = self._dirty, set()
+        batch = []
+        for key in dirty:
+            bucket = self._buckets.get(key)
+            if bucket is not None and bucket.pending:
+                batch.append((key, bucket, bucket.window, bucket.pending))
+                bucket.pending = 0
+        try:
+            if batch:
+                async with self.redis.pipeline(transaction=False) as pipe:
+                    for key, _, window, count in batch:
+                        redis_key = f"{self.prefix}:{key}:{window}"
+                        pipe.incrby(redis_key, count)
+                        pipe.pexpire(redis_key, int(self._periods[key] * 2000))
+                    results = await asyncio.wait_for(pipe.execute(), self.timeout)
+            elif not self.remote_ok:
+                await asyncio.wait_for(self.redis.ping(), self.timeout)
+                results = []
+            else:
+                return
+        except Exception:  # pylint: disable=broad-except
+            self.sync_failures += 1
+            self._retry_at = now + self.retry_interval
+            if self.remote_ok:
+                logging.getLogger("uvicorn.error").warning("Redis unreachable, rate limiting per worker only")
+            self.remote_ok = False
+            return
+        if not self.remote_ok:
+            logging.getLogger("uvicorn.error").info("Redis reachable, rate limits shared across workers")
+        self.remote_ok = True
+        self.syncs += 1
+        for (_, bucket, window, _), total in zip(batch, results[::2]):
+            if bucket.window == window:
+                bucket.others = max(int(total) - (bucket.count - bucket.pending), 0)
+
+    def _prune(self, now):
+        for key in [key for key, bucket in self._buckets.items() if now - bucket.updated > self.idle_seconds]:
+            del self._buckets[key]
+            del self._periods[key]
+        self._pruned = now
+
+    async def run(self):
+        """sync() every sync_interval until cancelled"""
+        while True:
+            await self.sync()
+            await asyncio.sleep(self.sync_interval)
+
+    async def close(self):
+        if self.redis is not None:
+            await self.sync()
+            await self.redis.aclose()
+            self.redis = None
+            self.remote_ok = False
+
+    def stats(self):
+        return {"Keys": len(self._buckets), "Redis": self.remote_ok, "Allowed": self.allowed,
+                "Limited": self.limited, "Syncs": self.syncs, "SyncFailures": self.sync_failures}
+
+
+rate_limits = RateLimits()
+
+
+def client_identifier(request: Request):
+    """First X-Forwarded-For address (the API runs behind a proxy) plus the path"""
+    forwarded = request.headers.get("X-Forwarded-For")
+    address = forwarded.split(",")[0] if forwarded else request.client.host
+    return address + ":" + request.scope["path"]
+
+
+class RateLimiter:
+    """Route dependency allowing times requests per period for each client and path, e.g.
+    dependencies=[Depends(RateLimiter(times=2, seconds=1))]"""
+
+    def __init__(self, times=1, seconds=0, milliseconds=0, minutes=0, limits=rate_limits):
+        self.times = times
+        self.period = seconds + milliseconds / 1000 + minutes * 60
+        self.limits = limits
+        self.rule = f"{times}/{self.period:g}"
+
+    async def __call__(self, request: Request, response: Response):
+        retry_after = self.limits.allow(f"{client_identifier(request)}:{request.method}:{self.rule}",
+                                        self.times, self.period)
+        if retry_after:
+            raise HTTPException(HTTP_429_TOO_MANY_REQUESTS, "Too Many Requests",
+                                headers={"Retry-After": str(max(ceil(retry_after), 1))})
@@ -0,0 +1,132 @@
+"""Byte-size bounded LRU cache of file contents for the daily results endpoints"""
+import os
+import threading
+from collections import OrderedDict
+from starlette.concurrency import run_in_threadpool
+from precompress import compress_bytes
+
+
+class CachedFile:
+    """File contents plus the stat result they were read with"""
+
+    __slots__ = ("content", "stat_result", "immutable", "encoded")
+
+    def __init__(self, content, stat_result, immutable):
+        self.content = content
+        self.stat_result = stat_result
+        self.immutable = immutable
+        self.encoded = {}
+
+    @property
+    def size(self):
+        return len(self.content) + sum(len(content) for content in self.encoded.values())
+
+    @property
+    def signature(self):
+        return (self.stat_result.st_mtime_ns, self.stat_result.st_ino, self.stat_result.st_size)
+
+
+def _read_with_stat(path):
+    with open(path, 'rb') as fp:
+        stat_result = os.fstat(fp.fileno())
+        return fp.read(), stat_result
+
+
+class FileCache:
+    """LRU keyed by path. Immutable (past date) entries are pinned and served without
+    touching disk; everything else is revalidated by mtime/inode/size on each hit."""
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self.current_bytes = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.revalidations = 0
+
+    async def get(self, path, immutable=False):
+        """Returns a CachedFile for path, reading it off the event loop on a miss.
+        Raises FileNotFoundError like open() would."""
+        entry = self._lookup(path)
+        if entry is not None and entry.immutable:
+            return entry
+        if entry is not None:
+            stat_result = await run_in_threadpool(os.stat, path)
+            is_current = (stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_size) == entry.signature
+            with self._lock:
+                self.revalidations += 1
+                if is_current:
+                    self.hits += 1
+            if is_current:
+                return entry
+            self._discard(path)
+        with self._lock:
+            self.misses += 1
+        content, stat_result = await run_in_threadpool(_read_with_stat, path)
+        entry = CachedFile(content, stat_result, immutable)
+        self._store(path, entry)
+        return entry
+
+    async def encoded(self, path, entry, encoding):
+        """Compressed copy of a cached entry, made once and kept alongside it"""
+        content = entry.encoded.get(encoding)
+        if content is not None:
+            return content
+        content = await run_in_threadpool(compress_bytes, entry.content, encoding)
+        with self._lock:
+            if encoding not in entry.encoded and self._entries.get(path) is entry:
+                entry.encoded[encoding] = content
+                self.current_bytes += len(content)
+                self._evict()
+        return content
+
+    def _lookup(self, path):
+        with self._lock:
+            entry = self._entries.get(path)
+            if entry is not None:
+                self._entries.move_to_end(path)
+                if entry.immutable:
+                    self.hits += 1
+            return entry
+
+    def _discard(self, path):
+        with self._lock:
+            entry = self._entries.pop(path, None)
+            if entry is not None:
+                self.current_bytes -= entry.size
+
+    def _store(self, path, entry):
+        size = len(entry.content)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            previous = self._entries.pop(path, None)
+            if previous is not None:
+                self.current_bytes -= previous.size
+            self._entries[path] = entry
+            self.current_bytes += size
+            self._evict()
+
+    def _evict(self):
+        while self.current_bytes > self.max_bytes and self._entries:
+            _, evicted = self._entries.popitem(last=False)
+            self.current_bytes -= evicted.size
+            self.evictions += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.current_bytes = 0
+
+    def stats(self):
+        """Counters for /api/metrics"""
+        with self._lock:
+            return {"Entries": len(self._entries),
+                    "Bytes": self.current_bytes,
+                    "MaxBytes": self.max_bytes,
+                    "Hits": self.hits,
+                    "Misses": self.misses,
+                    "Evictions": self.evictions,
+                    "Revalidations": self.revalidations}
@@ -0,0 +1,127 @@
+"""transit_stations.json flattened into (agency, route, station, direction) keys, plus the fare tables"""
+import json
+import os
+import threading
+import time
+
+LOOP_ROUTES = ('Brown', 'Orange', 'Pink', 'Purple')
+LOOP_STATIONS = ('Clark/Lake', 'State/Lake', 'Washington/Wabash', 'Adams/Wabash',
+                 'Harold Washington Library', 'LaSalle/Van Buren', 'Quincy', 'Washington/Wells')
+DIRECTIONS = ('Outbound', 'Inbound')
+ZONED_AGENCIES = ('metra', 'southshoreline')
+
+# Fares are (full, reduced). Zone fares apply in either direction of travel.
+FLAT_FARES = {"cta": (2.5, 2.5), "amtrak": (0, 0), "southshoreline": (0, 0)}
+STATION_FARES = {("cta", "O'Hare"): (5, 5)}
+METRA_ZONE_RULES = (((2, 3, 4), (2, 3, 4), (3.75, 1.75)),
+                    ((1, 2), (1, 2), (3.75, 1.75)),
+                    ((1,), (3,), (5.50, 2.75)),
+                    ((1,), (4,), (6.75, 3.25)))
+
+
+class MissingTicketType(ValueError):
+    """A zone-priced trip posted without a Ticket Type, so there is no telling which fare applies"""
+
+
+def _zone_fares(rules):
+    fares = {}
+    for origin_zones, destination_zones, fare in rules:
+        for origin_zone in origin_zones:
+            for destination_zone in destination_zones:
+                fares[(origin_zone, destination_zone)] = fares[(destination_zone, origin_zone)] = fare
+    return fares
+
+
+ZONE_FARES = {"metra": _zone_fares(METRA_ZONE_RULES)}
+
+
+def trip_fare(agency, origin, origin_zone, destination_zone, ticket_type):
+    """Raises KeyError for an agency or zone pair without a fare, like the old if-chains failing did,
+    and MissingTicketType when a zone fare has no Ticket Type to choose between full and reduced"""
+    if agency in ZONE_FARES:
+        if not ticket_type:
+            raise MissingTicketType("Ticket Type is required for " + agency)
+        full, reduced = ZONE_FARES[agency][(origin_zone, destination_zone)]
+    else:
+        full, reduced = STATION_FARES.get((agency, origin)) or FLAT_FARES[agency]
+    return reduced if "Reduced" in (ticket_type or "") else full
+
+
+def trip_direction(route, origin):
+    """Loop routes have separate Outbound/Inbound mileage - outbound when the trip starts in the Loop"""
+    if route in LOOP_ROUTES:
+        return 'Outbound' if origin in LOOP_STATIONS else 'Inbound'
+    return None
+
+
+class StationRegistry:
+    """Loaded once and reloaded when the file changes (checked at most once per min_interval)"""
+
+    def __init__(self, path, min_interval=1.0):
+        self.path = path
+        self.min_interval = min_interval
+        self._lock = threading.Lock()
+        self._stations = {}
+        self._signature = None
+        self._checked = 0.0
+        self.reloads = 0
+
+    def _refresh(self):
+        now = time.monotonic()
+        if now - self._checked < self.min_interval:
+            return
+        with self._lock:
+            if now - self._checked < self.min_interval:
+                return
+            stat_result = os.stat(self.path)
+            signature = (stat_result.st_mtime_ns, stat_result.st_ino, stat_result.st_size)
+            if signature != self._signature:
+                with open(self.path, 'r', encoding="utf-8") as fp:
+                    self._stations = self._flatten(json.load(fp))
+                self._signature = signature
+                self.reloads += 1
+            self._checked = now
+
+    @staticmethod
+    def _flatten(transit_stations):
+        """key -> (miles, kilometers, zone); direction is None for stations without directional mileage"""
+        stations = {}
+        for agency, routes in transit_stations.items():
+            for route, route_stations in routes.items():
+                for station, details in route_stations.items():
+                    zone = details.get('Zone')
+                    if 'Miles' in details:
+                        stations[(agency, route, station, None)] = (details['Miles'], details['Kilometers'], zone)
+                    for direction in DIRECTIONS:
+                        if direction in details:
+                            stations[(agency, route, station, direction)] = (
+                                details[direction]['Miles'], details[direction]['Kilometers'], zone)
+        return stations
+
+    def lookup(self, agency, route, station, direction=None):
+        """(miles, kilometers, zone) - raises KeyError for an unknown station"""
+        self._refresh()
+        return self._stations[(agency, route, station, direction)]
+
+    def enrich(self, agency, trip):
+        """Adds the mileage, zone, distance and fare fields to a trip posted to /api/transit/post"""
+        self._refresh()
+        stations = self._stations
+        direction = trip_direction(trip['Route'], trip['Origin'])
+        origin_miles, origin_kilometers, origin_zone = stations[(agency, trip['Route'], trip['Origin'], direction)]
+        destination_miles, destination_kilometers, destination_zone = stations[
+            (agency, trip['Route'], trip['Destination'], direction)]
+        trip['Origin Station - Mileage'] = origin_miles
+        trip['Origin Station - Kilometers'] = origin_kilometers
+        trip['Destination Station - Mileage'] = destination_miles
+        trip['Destination Station - Kilometers'] = destination_kilometers
+        if agency in ZONED_AGENCIES:
+            trip['Origin Station - Zone'] = origin_zone
+            trip['Destination Station - Zone'] = destination_zone
+        trip['Track Miles'] = abs(round(origin_miles - destination_miles, 2))
+        trip['Track Kilometers'] = abs(round(origin_kilometers - destination_kilometers, 2))
+        trip['Trip Cost'] = trip_fare(agency, trip['Origin'], origin_zone, destination_zone, trip.get('Ticket Type'))
+        return trip
+
+    def stats(self):
+        return {"Stations": len(self._stations), "Reloads": self.reloads}
@@ -0,0 +1,146 @@
+"""Tesla battery readings in SQLite: append and undo touch one row, reads use the day index"""
+import json
+import os
+import sys
+import threading
+from dateutil import parser as date_parser
+from database import connect, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS readings (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    date TEXT NOT NULL,
+    time TEXT NOT NULL,
+    battery TEXT NOT NULL,
+    miles TEXT NOT NULL,
+    day TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS readings_day ON readings (day, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+COLUMNS = "date, time, battery, miles"
+
+
+def reading_day(date):
+    """YYYY-MM-DD for whatever date format the client posted, so ranges can use the index"""
+    try:
+        return date_parser.parse(date).date().isoformat()
+    except (ValueError, OverflowError):
+        return date
+
+
+def _reading(row):
+    return {"Date": row[0], "Time": row[1], "Battery": row[2], "MilesRemaining": row[3]}
+
+
+class TeslaStore:
+    """The tesla.json list as an append-only table, ordered by insertion like the list was"""
+
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = connect(path)
+        self.connection.executescript(SCHEMA)
+        if json_path:
+            self._migrate_json(json_path)
+
+    def _migrate_json(self, json_path):
+        """Imports tesla.json once. Every worker runs this at startup, so the check and the import
+        share one BEGIN IMMEDIATE transaction and the result is recorded in meta - an emptied table
+        is never refilled from the stale file."""
+        with transaction(self.connection, self._lock) as connection:
+            if connection.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                return
+            is_empty = connection.execute("SELECT 1 FROM readings LIMIT 1").fetchone() is None
+            if is_empty and os.path.exists(json_path):
+                self._insert_json(connection, json_path)
+            connection.execute("INSERT INTO meta VALUES ('json_imported', ?)", (json_path,))
+
+    def append(self, date, time, battery, miles):
+        """Adds a reading and returns the one before it (None for the first reading)"""
+        with transaction(self.connection, self._lock) as connection:
+            row = connection.execute(f"SELECT {COLUMNS} FROM readings ORDER BY id DESC LIMIT 1").fetchone()
+            connection.execute(f"INSERT INTO readings ({COLUMNS}, day) VALUES (?, ?, ?, ?, ?)",
+                               (date, time, battery, miles, reading_day(date)))
+        return _reading(row) if row else None
+
+    def undo(self):
+        """Removes and returns the newest reading, or None if there are none"""
+        with self._lock:
+            row = self.connection.execute(
+                f"DELETE FROM readings WHERE id = (SELECT MAX(id) FROM readings) RETURNING {COLUMNS}").fetchone()
+        return _reading(row) if row else None
+
+    def tail(self, count=None):
+        """The newest count readings (all of them for None), oldest first"""
+        with self._lock:
+            if count is None:
+                rows = self.connection.execute(f"SELECT {COLUMNS} FROM readings ORDER BY id").fetchall()
+            else:
+                rows = self.connection.execute(
+                    f"SELECT {COLUMNS} FROM (SELECT id, {COLUMNS} FROM readings ORDER BY id DESC LIMIT ?) "
+                    "ORDER BY id", (max(count, 0),)).fetchall()
+        return [_reading(row) for row in rows]
+
+    def _range_where(self, start, end):
+        clauses, parameters = [], []
+        if start:
+            clauses.append("day >= ?")
+            parameters.append(reading_day(start))
+        if end:
+            clauses.append("day <= ?")
+            parameters.append(reading_day(end))
+        return (f"WHERE {' AND '.join(clauses)}" if clauses else ""), parameters
+
+    def between(self, start=None, end=None):
+        """Readings whose day is within [start, end], oldest first"""
+        where, parameters = self._range_where(start, end)
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT {COLUMNS} FROM readings {where} ORDER BY day, id", parameters).fetchall()
+        return [_reading(row) for row in rows]
+
+    def daily(self, start=None, end=None):
+        """One min/max/average row per day, for charting"""
+        where, parameters = self._range_where(start, end)
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT day, COUNT(*), MIN(CAST(battery AS REAL)), MAX(CAST(battery AS REAL)), "
+                "AVG(CAST(battery AS REAL)), MIN(CAST(miles AS REAL)), MAX(CAST(miles AS REAL)), "
+                f"AVG(CAST(miles AS REAL)) FROM readings {where} GROUP BY day ORDER BY day", parameters).fetchall()
+        return [{"Date": day, "Readings": count,
+                 "BatteryMin": battery_min, "BatteryMax": battery_max, "BatteryAvg": round(battery_avg, 1),
+                 "MilesMin": miles_min, "MilesMax": miles_max, "MilesAvg": round(miles_avg, 1)}
+                for day, count, battery_min, battery_max, battery_avg, miles_min, miles_max, miles_avg in rows]
+
+    def import_json(self, json_path):
+        with transaction(self.connection, self._lock) as connection:
+            self._insert_json(connection, json_path)
+
+    @staticmethod
+    def _insert_json(connection, json_path):
+        with open(json_path, 'r', encoding="utf-8") as fp:
+            json_file_loaded = json.load(fp)
+        connection.executemany(
+            f"INSERT INTO readings ({COLUMNS}, day) VALUES (?, ?, ?, ?, ?)",
+            ((entry['Date'], entry['Time'], str(entry['Battery']), str(entry['MilesRemaining']),
+              reading_day(entry['Date'])) for entry in json_file_loaded))
+
+    def export_json(self, json_path):
+        """Writes tesla.json in the format the API used to keep it in"""
+        temp_path = f"{json_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding="utf-8") as fp:
+            json.dump(self.tail(), fp, indent=4, separators=(',', ': '))
+        os.replace(temp_path, json_path)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    data_path = os.getenv('API_FILE_PATH') + "data/"
+    json_path = sys.argv[1] if len(sys.argv) > 1 else data_path + "tesla.json"
+    TeslaStore(data_path + "tesla.db").export_json(json_path)
+    print(f"export: {json_path}")
@@ -0,0 +1,148 @@
+"""CSV, NDJSON and Parquet exports of tracker trips, streamed row by row from the trip store"""
+import csv
+import io
+import json
+from lazy_imports import lazy_import
+
+# Parquet exports are only offered when pyarrow is installed; it is imported on the first one
+pa = lazy_import("pyarrow", optional=True)
+pq = lazy_import("pyarrow.parquet")
+
+ROWS_PER_CHUNK = 1000
+ROWS_PER_ROW_GROUP = 10000
+
+# (column, trip field, kind). User and Agency come from where the trip is stored, not the trip itself.
+TRIP_COLUMNS = (
+    ("User", None, "text"),
+    ("Date", "Date", "text"),
+    ("Agency", None, "text"),
+    ("Route", "Route", "text"),
+    ("RunNumber", "Run Number", "text"),
+    ("Origin", "Origin", "text"),
+    ("Origin_Zone", "Origin Station - Zone", "text"),
+    ("Origin_Miles", "Origin Station - Mileage", "number"),
+    ("Origin_Kilometers", "Origin Station - Kilometers", "number"),
+    ("Destination", "Destination", "text"),
+    ("Destination_Zone", "Destination Station - Zone", "text"),
+    ("Destination_Miles", "Destination Station - Mileage", "number"),
+    ("Destination_Kilometers", "Destination Station - Kilometers", "number"),
+    ("Trip_Miles", "Track Miles", "number"),
+    ("Trip_Kilometers", "Track Kilometers", "number"),
+    ("Trip_Cost", "Trip Cost", "cost"),
+    ("Ticket_Type", "Ticket Type", "text"),
+)
+COLUMN_NAMES = [column for column, _, _ in TRIP_COLUMNS]
+
+
+def trip_values(username, agency, trip):
+    """One trip as raw values in TRIP_COLUMNS order, None where the trip does not have the field"""
+    values = []
+    for column, field, _ in TRIP_COLUMNS:
+        if column == "User":
+            values.append(username)
+        elif column == "Agency":
+            values.append(agency)
+        else:
+            values.append(trip.get(field))
+    return values
+
+
+def _csv_value(value, kind):
+    if value is None:
+        return ""
+    if kind == "cost":
+        return f"{value:.2f}"
+    return value
+
+
+def iter_csv(trips):
+    """trips is an iterable of (username, agency, trip_id, trip)"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    kinds = [kind for _, _, kind in TRIP_COLUMNS]
+    writer.writerow(COLUMN_NAMES)
+    pending = 0
+    for username, agency, _, trip in trips:
+        writer.writerow([_csv_value(value, kind) for value, kind in zip(trip_values(username, agency, trip), kinds)])
+        pending += 1
+        if pending >= ROWS_PER_CHUNK:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+            pending = 0
+    yield buffer.getvalue().encode("utf-8")
+
+
+def iter_ndjson(trips):
+    """One JSON object per trip, keyed by the CSV column names, values as stored"""
+    lines = []
+    for username, agency, _, trip in trips:
+        lines.append(json.dumps(dict(zip(COLUMN_NAMES, trip_values(username, agency, trip)))))
+        if len(lines) >= ROWS_PER_CHUNK:
+            yield ("\n".join(lines) + "\n").encode("utf-8")
+            lines = []
+    if lines:
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+class _ChunkSink(io.RawIOBase):
+    """Write-only file that hands back whatever has been written since the last drain"""
+
+    def __init__(self):
+        super().__init__()
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._position
+
+    def drain(self):
+        chunk = b"".join(self._chunks)
+        self._chunks = []
+        return chunk
+
+
+def _parquet_value(value, kind):
+    if value is None or value == "":
+        return None
+    return str(value) if kind == "text" else float(value)
+
+
+def iter_parquet(trips, rows_per_row_group=ROWS_PER_ROW_GROUP):
+    """Parquet written one row group at a time, so only a row group is ever held in memory"""
+    schema = pa.schema([(column, pa.string() if kind == "text" else pa.float64())
+                        for column, _, kind in TRIP_COLUMNS])
+    kinds = [kind for _, _, kind in TRIP_COLUMNS]
+    sink = _ChunkSink()
+    writer = pq.ParquetWriter(sink, schema, compression="zstd")
+    rows = []
+
+    def write_rows():
+        columns = list(zip(*rows)) if rows else [[] for _ in kinds]
+        writer.write_table(pa.Table.from_arrays(
+            [pa.array([_parquet_value(value, kind) for value in column], type=field.type)
+             for column, kind, field in zip(columns, kinds, schema)], schema=schema))
+    for username, agency, _, trip in trips:
+        rows.append(trip_values(username, agency, trip))
+        if len(rows) >= rows_per_row_group:
+            write_rows()
+            rows = []
+            yield sink.drain()
+    if rows:
+        write_rows()
+    writer.close()
+    yield sink.drain()
+
+
+EXPORT_FORMATS = {"CSV": ("text/csv", "csv", iter_csv),
+                  "NDJSON": ("application/x-ndjson", "ndjson", iter_ndjson)}
+if pa is not None:
+    EXPORT_FORMATS["PARQUET"] = ("application/vnd.apache.parquet", "parquet", iter_parquet)
@@ -0,0 +1,286 @@
+"""Transit tracker trips in SQLite, so adding one trip no longer rewrites every user's history"""
+import json
+import os
+import sys
+import re
+import threading
+from dateutil import parser as date_parser
+from database import connect, transaction
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY
+);
+CREATE TABLE IF NOT EXISTS user_agencies (
+    username TEXT NOT NULL REFERENCES users(username),
+    agency TEXT NOT NULL,
+    PRIMARY KEY (username, agency)
+);
+CREATE TABLE IF NOT EXISTS trips (
+    username TEXT NOT NULL,
+    agency TEXT NOT NULL,
+    trip_id TEXT NOT NULL,
+    data TEXT NOT NULL,
+    PRIMARY KEY (username, agency, trip_id),
+    FOREIGN KEY (username, agency) REFERENCES user_agencies(username, agency)
+);
+CREATE TABLE IF NOT EXISTS trip_summaries (
+    username TEXT NOT NULL,
+    agency TEXT NOT NULL,
+    month TEXT NOT NULL,
+    trips INTEGER NOT NULL,
+    miles REAL NOT NULL,
+    kilometers REAL NOT NULL,
+    cost REAL NOT NULL,
+    PRIMARY KEY (username, agency, month)
+);
+CREATE TABLE IF NOT EXISTS meta (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+# Trips whose Date is missing or unreadable are rolled up under this month instead of being dropped
+UNKNOWN_MONTH = "unknown"
+ISO_MONTH = re.compile(r"^\d{4}-\d{2}")
+
+
+def trip_month(date):
+    """YYYY-MM for a trip's Date - also registered as the trip_month() SQL function"""
+    if date is None or str(date).strip() == "":
+        return UNKNOWN_MONTH
+    date = str(date)
+    if ISO_MONTH.match(date):
+        return date[:7]
+    try:
+        return date_parser.parse(date).strftime("%Y-%m")
+    except (ValueError, OverflowError):
+        return UNKNOWN_MONTH
+
+
+REBUILD_SUMMARIES = ("DELETE FROM trip_summaries", """
+INSERT INTO trip_summaries
+SELECT username, agency, trip_month(json_extract(data, '$.Date')), COUNT(*),
+       TOTAL(json_extract(data, '$."Track Miles"')), TOTAL(json_extract(data, '$."Track Kilometers"')),
+       TOTAL(json_extract(data, '$."Trip Cost"'))
+FROM trips GROUP BY 1, 2, 3
+""")
+
+
+def _update_summary(connection, username, agency, trip, sign):
+    """Adds (sign=1) or takes away (sign=-1) one trip from its agency/month rollup"""
+    connection.execute(
+        "INSERT INTO trip_summaries VALUES (?, ?, ?, ?, ?, ?, ?) ON CONFLICT (username, agency, month) DO UPDATE SET "
+        "trips = trips + excluded.trips, miles = miles + excluded.miles, "
+        "kilometers = kilometers + excluded.kilometers, cost = cost + excluded.cost",
+        (username, agency, trip_month(trip.get('Date')), sign, sign * float(trip.get('Track Miles') or 0),
+         sign * float(trip.get('Track Kilometers') or 0), sign * float(trip.get('Trip Cost') or 0)))
+    if sign < 0:
+        connection.execute("DELETE FROM trip_summaries WHERE username = ? AND agency = ? AND trips <= 0",
+                           (username, agency))
+
+
+def _totals(trips, miles, kilometers, cost):
+    return {"Trips": trips, "Miles": round(miles, 2), "Kilometers": round(kilometers, 2), "Cost": round(cost, 2)}
+
+
+class TripStore:
+    """users -> agencies -> trips, laid out the same way as transit_trips.json. One connection
+    and a lock make this the only writer; every change is its own transaction."""
+
+    def __init__(self, path, json_path=None):
+        self.path = path
+        self._lock = threading.Lock()
+        self.connection = connect(path)
+        self.connection.create_function("trip_month", 1, trip_month, deterministic=True)
+        self.connection.executescript(SCHEMA)
+        if json_path:
+            self._migrate_json(json_path)
+        if self._needs_summaries():
+            self.rebuild_summaries()
+
+    def transaction(self):
+        return transaction(self.connection, self._lock)
+
+    def _migrate_json(self, json_path):
+        """Imports transit_trips.json once, like TeslaStore: the check, the import and the meta row
+        recording it share one transaction, so deleting every trip never brings the file back"""
+        with self.transaction() as connection:
+            if connection.execute("SELECT 1 FROM meta WHERE key = 'json_imported'").fetchone():
+                return
+            is_empty = connection.execute("SELECT 1 FROM users LIMIT 1").fetchone() is None
+            if is_empty and os.path.exists(json_path):
+                self._insert_json(connection, json_path)
+            connection.execute("INSERT INTO meta VALUES ('json_imported', ?)", (json_path,))
+
+    def _needs_summaries(self):
+        with self._lock:
+            return (self.connection.execute("SELECT 1 FROM trip_summaries LIMIT 1").fetchone() is None
+                    and self.connection.execute("SELECT 1 FROM trips LIMIT 1").fetchone() is not None)
+
+    def has_user(self, username):
+        with self._lock:
+            return self.connection.execute(
+                "SELECT 1 FROM users WHERE username = ?", (username,)).fetchone() is not None
+
+    def add_user(self, username):
+        """Returns False if the user already existed"""
+        with self.transaction() as connection:
+            return connection.execute("INSERT OR IGNORE INTO users VALUES (?)", (username,)).rowcount == 1
+
+    def add_agency(self, username, agency):
+        with self.transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO user_agencies VALUES (?, ?)", (username, agency))
+
+    def get_trip(self, username, agency, trip_id):
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT data FROM trips WHERE username = ? AND agency = ? AND trip_id = ?",
+                (username, agency, trip_id)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def add_trip(self, username, agency, trip_id, trip):
+        """Returns False (and changes nothing) if the trip is already there"""
+        with self.transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO user_agencies VALUES (?, ?)", (username, agency))
+            added = connection.execute("INSERT OR IGNORE INTO trips VALUES (?, ?, ?, ?)",
+                                       (username, agency, trip_id, json.dumps(trip))).rowcount == 1
+            if added:
+                _update_summary(connection, username, agency, trip, 1)
+            return added
+
+    def add_trips(self, username, agency, trips):
+        """[(trip_id, trip)] in a single transaction - returns, for each, whether it was added"""
+        with self.transaction() as connection:
+            connection.execute("INSERT OR IGNORE INTO user_agencies VALUES (?, ?)", (username, agency))
+            results = []
+            for trip_id, trip in trips:
+                added = connection.execute("INSERT OR IGNORE INTO trips VALUES (?, ?, ?, ?)",
+                                           (username, agency, trip_id, json.dumps(trip))).rowcount == 1
+                if added:
+                    _update_summary(connection, username, agency, trip, 1)
+                results.append(added)
+            return results
+
+    def remove_trip(self, username, agency, trip_id):
+        """Returns the removed trip, or None if it did not exist"""
+        with self.transaction() as connection:
+            row = connection.execute(
+                "DELETE FROM trips WHERE username = ? AND agency = ? AND trip_id = ? RETURNING data",
+                (username, agency, trip_id)).fetchone()
+            if row is None:
+                return None
+            trip = json.loads(row[0])
+            _update_summary(connection, username, agency, trip, -1)
+        return trip
+
+    def _collect(self, where, parameters):
+        result = {}
+        with self._lock:
+            for username, agency in self.connection.execute(
+                    f"SELECT users.username, agency FROM users LEFT JOIN user_agencies USING (username) {where} "
+                    "ORDER BY users.username, agency", parameters):
+                agencies = result.setdefault(username, {})
+                if agency is not None:
+                    agencies[agency] = {}
+            for username, agency, trip_id, data in self.connection.execute(
+                    f"SELECT username, agency, trip_id, data FROM trips {where} "
+                    "ORDER BY username, agency, trip_id", parameters):
+                result[username][agency][trip_id] = json.loads(data)
+        return result
+
+    def user_trips(self, username):
+        """{agency: {trip_id: trip}} for one user, or None if there is no such user"""
+        return self._collect("WHERE username = ?", (username,)).get(username)
+
+    def all_trips(self):
+        """Everything, in the transit_trips.json layout"""
+        return self._collect("", ())
+
+    def iter_trips(self, username=None):
+        """(username, agency, trip_id, trip) in order, read on a connection of its own so a long
+        export neither holds the writer lock nor loads every trip at once"""
+        connection = connect(self.path)
+        where, parameters = ("WHERE username = ?", (username,)) if username else ("", ())
+        try:
+            for row_username, agency, trip_id, data in connection.execute(
+                    f"SELECT username, agency, trip_id, data FROM trips {where} "
+                    "ORDER BY username, agency, trip_id", parameters):
+                yield row_username, agency, trip_id, json.loads(data)
+        finally:
+            connection.close()
+
+    def import_json(self, json_path):
+        with self.transaction() as connection:
+            self._insert_json(connection, json_path)
+
+    @staticmethod
+    def _insert_json(connection, json_path):
+        with open(json_path, 'r', encoding="utf-8") as fp:
+            json_file_loaded = json.load(fp)
+        for username, agencies in json_file_loaded.items():
+            connection.execute("INSERT OR IGNORE INTO users VALUES (?)", (username,))
+            for agency, trips in agencies.items():
+                connection.execute("INSERT OR IGNORE INTO user_agencies VALUES (?, ?)", (username, agency))
+                connection.executemany("INSERT OR REPLACE INTO trips VALUES (?, ?, ?, ?)",
+                                       ((username, agency, trip_id, json.dumps(trip))
+                                        for trip_id, trip in trips.items()))
+        for statement in REBUILD_SUMMARIES:
+            connection.execute(statement)
+
+    def rebuild_summaries(self):
+        """Recomputes every rollup from the trips themselves"""
+        with self.transaction() as connection:
+            for statement in REBUILD_SUMMARIES:
+                connection.execute(statement)
+
+    def summary(self, username=None, agency=None, month=None):
+        """Totals for a user (or everyone), overall and by agency, month and agency/month,
+        read from the rollups. month may be a prefix, e.g. 2024 or 2024-03."""
+        clauses, parameters = [], []
+        for column, value in (("username", username), ("agency", agency)):
+            if value:
+                clauses.append(f"{column} = ?")
+                parameters.append(value)
+        if month:
+            clauses.append("month LIKE ?")
+            parameters.append(month.replace("%", "").replace("_", "") + "%")
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            rows = self.connection.execute(
+                f"SELECT agency, month, SUM(trips), SUM(miles), SUM(kilometers), SUM(cost) FROM trip_summaries {where} "
+                "GROUP BY agency, month ORDER BY agency, month", parameters).fetchall()
+        by_agency, by_month, by_agency_month = {}, {}, {}
+        overall = [0, 0.0, 0.0, 0.0]
+        for row_agency, row_month, *values in rows:
+            for totals in (overall, by_agency.setdefault(row_agency, [0, 0.0, 0.0, 0.0]),
+                           by_month.setdefault(row_month, [0, 0.0, 0.0, 0.0])):
+                for position, value in enumerate(values):
+                    totals[position] += value
+            by_agency_month.setdefault(row_agency, {})[row_month] = _totals(*values)
+        return {"Totals": _totals(*overall),
+                "ByAgency": {key: _totals(*values) for key, values in by_agency.items()},
+                "ByMonth": {key: _totals(*values) for key, values in sorted(by_month.items())},
+                "ByAgencyMonth": by_agency_month}
+
+    def export_json(self, json_path):
+        """Writes transit_trips.json exactly as the API used to"""
+        temp_path = f"{json_path}.{os.getpid()}.tmp"
+        with open(temp_path, 'w', encoding="utf-8") as fp:
+            json.dump(self.all_trips(), fp, indent=4, separators=(',', ': '), sort_keys=True)
+        os.replace(temp_path, json_path)
+
+
+if __name__ == '__main__':
+    from dotenv import load_dotenv
+    load_dotenv()
+    transit_data_path = os.getenv('FILE_PATH_TRANSIT_DATA')
+    command = sys.argv[1] if len(sys.argv) > 1 else "export"
+    json_path = sys.argv[2] if len(sys.argv) > 2 else transit_data_path + "transit_trips.json"
+    store = TripStore(transit_data_path + "transit_trips.db")
+    if command == "import":
+        store.import_json(json_path)
+    elif command == "rebuild-summaries":
+        store.rebuild_summaries()
+    else:
+        store.export_json(json_path)
+    print(f"{command}: {json_path}")
@@ -0,0 +1,244 @@
+"""Paged arrivals queries against BigQuery (or a local SQLite/DuckDB stand-in), streamed out as CSV"""
+import asyncio
+import csv
+import io
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from lazy_imports import lazy_import
+
+# The Google client libraries take about a second and 100+ MB to import, so they load on the first
+# warehouse query (or credential refresh) rather than in every worker at startup
+bigquery = lazy_import("google.cloud.bigquery")
+service_account = lazy_import("google.oauth2.service_account")
+google_auth_requests = lazy_import("google.auth.transport.requests")
+
+PAGE_SIZE = 10000
+ARRIVALS_TABLE = "cta-utilities-410023.cta.processed_arrivals"
+DATE_PATTERN = re.compile(r"^\d{4}-\d{2}-\d{2}([ T]\d{2}:\d{2}(:\d{2}(\.\d+)?)?)?$")
+
+
+def validate_date(value):
+    """startdate/enddate end up in SQL, so only accept plain dates and datetimes"""
+    if not DATE_PATTERN.match(value):
+        raise ValueError(f"Invalid date: {value}")
+    return value
+
+
+class WarehouseClient:
+    """One BigQuery client and credential set shared by every request, with the blocking
+    query/fetch calls run in a bounded executor instead of on the event loop"""
+
+    def __init__(self, credentials_file, max_workers=4, refresh_margin=300):
+        self.credentials_file = credentials_file
+        self.refresh_margin = timedelta(seconds=refresh_margin)
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="warehouse")
+        self._credentials = None
+        self._client = None
+        self._lock = threading.Lock()
+        self.queued = 0
+        self.running = 0
+        self.stats_by_label = {}
+        self.token_refreshes = 0
+
+    def client(self):
+        """The shared bigquery.Client, created on first use"""
+        if self._client is None:
+            with self._lock:
+                if self._client is None:
+                    self._credentials = service_account.Credentials.from_service_account_file(
+                        self.credentials_file, scopes=["https://www.googleapis.com/auth/cloud-platform"])
+                    self._client = bigquery.Client(credentials=self._credentials,
+                                                   project=self._credentials.project_id)
+        return self._client
+
+    def refresh_credentials(self):
+        """Mints a new token before the current one expires so no request waits on it"""
+        credentials = self._credentials
+        if credentials is None:
+            return
+        expiry = credentials.expiry
+        if credentials.valid and expiry is not None and expiry - datetime.utcnow() > self.refresh_margin:
+            return
+        credentials.refresh(google_auth_requests.Request())
+        with self._lock:
+            self.token_refreshes += 1
+
+    def _call(self, label, func, args):
+        with self._lock:
+            self.queued -= 1
+            self.running += 1
+        started = time.perf_counter()
+        try:
+            return func(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self.running -= 1
+                count, total, largest = self.stats_by_label.get(label, (0, 0.0, 0.0))
+                self.stats_by_label[label] = (count + 1, total + elapsed, max(largest, elapsed))
+
+    async def run(self, func, *args, label="query"):
+        """Runs a blocking call in the warehouse executor"""
+        with self._lock:
+            self.queued += 1
+        return await asyncio.get_running_loop().run_in_executor(self.executor, self._call, label, func, args)
+
+    async def stream(self, iterator):
+        """Pulls a blocking iterator (e.g. encode_csv over result pages) through the executor"""
+        finished = object()
+        while True:
+            chunk = await self.run(next, iterator, finished, label="fetch")
+            if chunk is finished:
+                break
+            yield chunk
+
+    def shutdown(self):
+        self.executor.shutdown(wait=False, cancel_futures=True)
+
+    def stats(self):
+        """Queue depth and latency figures for /api/metrics"""
+        with self._lock:
+            stats = {"QueueDepth": self.queued, "Running": self.running, "TokenRefreshes": self.token_refreshes}
+            for label, (count, total, largest) in self.stats_by_label.items():
+                name = label.capitalize()
+                stats[f"{name}Count"] = count
+                stats[f"{name}AverageMs"] = round(total / count * 1000, 2)
+                stats[f"{name}MaxMs"] = round(largest * 1000, 2)
+            return stats
+
+
+def build_query(table, startdate, enddate, row_filter, columns, quote, placeholder, time_of_day, date_value):
+    """SELECT for one date window, with the row filter's projection and predicates pushed down.
+    date_value renders the (already validated) window bounds, everything else goes through placeholder."""
+    select = "*"
+    where = [f"Arrival_Time >= {date_value(validate_date(startdate))}",
+             f"Arrival_Time < {date_value(validate_date(enddate))}"]
+    if row_filter is not None and not row_filter.is_empty:
+        select, filter_where = row_filter.resolve(columns).sql(quote, placeholder, time_of_day)
+        where += filter_where
+    return f"SELECT {select} FROM {table} WHERE {' AND '.join(where)} ORDER BY Arrival_Time ASC"
+
+
+class BigQueryArrivalsBackend:
+    """Arrivals from the processed_arrivals table in BigQuery"""
+
+    def __init__(self, warehouse_client, table=ARRIVALS_TABLE):
+        self.warehouse_client = warehouse_client
+        self.table = table
+        self._columns = None
+
+    def _column_names(self, client):
+        if self._columns is None:
+            self._columns = [field.name for field in client.get_table(self.table).schema]
+        return self._columns
+
+    def columns(self, row_filter=None):
+        """The columns query() returns, from the table schema without running a query"""
+        columns = self._column_names(self.warehouse_client.client())
+        return row_filter.resolve(columns).columns if row_filter is not None and not row_filter.is_empty else list(columns)
+
+    def query(self, startdate, enddate, page_size=PAGE_SIZE, row_filter=None):
+        """Runs the query and returns (columns, pages) - pages is a lazy iterator of row lists"""
+        client = self.warehouse_client.client()
+        parameters = []
+
+        def placeholder(value):
+            name = f"p{len(parameters)}"
+            parameters.append(bigquery.ScalarQueryParameter(name, "STRING", value))
+            return f"@{name}"
+        columns = self._column_names(client) if row_filter is not None and not row_filter.is_empty else None
+        sql = build_query(f"`{self.table}`", startdate, enddate, row_filter, columns,
+                          lambda name: f"`{name}`", placeholder,
+                          lambda column: f"SUBSTR(CAST({column} AS STRING), 12, 8)",
+                          lambda value: f"'{value}'")
+        query_job = client.query(sql, job_config=bigquery.QueryJobConfig(query_parameters=parameters))
+        rows = query_job.result(page_size=page_size)
+        columns = [field.name for field in rows.schema]
+        pages = ([list(row.values()) for row in page] for page in rows.pages)
+        return columns, pages
+
+
+class LocalArrivalsBackend:
+    """Arrivals from a local SQLite (or DuckDB, for .duckdb files) copy of processed_arrivals"""
+
+    def __init__(self, path, table="processed_arrivals"):
+        self.path = path
+        self.table = table
+
+    def _connect(self):
+        if self.path.endswith(".duckdb"):
+            import duckdb  # pylint: disable=import-outside-toplevel
+            return duckdb.connect(self.path, read_only=True)
+        return sqlite3.connect(self.path, check_same_thread=False)
+
+    def columns(self, row_filter=None):
+        """The columns query() returns, without running it"""
+        connection = self._connect()
+        try:
+            cursor = connection.cursor()
+            cursor.execute(f'SELECT * FROM "{self.table}" LIMIT 0')
+            columns = [description[0] for description in cursor.description]
+        finally:
+            connection.close()
+        return row_filter.resolve(columns).columns if row_filter is not None and not row_filter.is_empty else columns
+
+    def query(self, startdate, enddate, page_size=PAGE_SIZE, row_filter=None):
+        """Runs the query and returns (columns, pages) - pages is a lazy iterator of row lists"""
+        connection = self._connect()
+        cursor = connection.cursor()
+        columns = None
+        if row_filter is not None and not row_filter.is_empty:
+            cursor.execute(f'SELECT * FROM "{self.table}" LIMIT 0')
+            columns = [description[0] for description in cursor.description]
+        parameters = []
+
+        def placeholder(value):
+            parameters.append(value)
+            return "?"
+        sql = build_query(f'"{self.table}"', startdate, enddate, row_filter, columns,
+                          lambda name: f'"{name}"', placeholder,
+                          lambda column: f"substr(CAST({column} AS TEXT), 12, 8)", placeholder)
+        cursor.execute(sql, parameters)
+        columns = [description[0] for description in cursor.description]
+
+        def pages():
+            try:
+                while True:
+                    page = cursor.fetchmany(page_size)
+                    if not page:
+                        break
+                    yield page
+            finally:
+                connection.close()
+        return columns, pages()
+
+
+def make_arrivals_backend(spec, warehouse_client):
+    """ARRIVALS_BACKEND=sqlite:/path/to.db or duckdb:/path/to.duckdb, anything else means BigQuery"""
+    if spec:
+        kind, _, path = spec.partition(":")
+        if kind in ("sqlite", "duckdb"):
+            return LocalArrivalsBackend(path)
+    return BigQueryArrivalsBackend(warehouse_client)
+
+
+def encode_csv(columns, pages):
+    """Yields the header and then one CSV chunk per page so nothing is held beyond a page"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+
+    def drain():
+        chunk = buffer.getvalue().encode("utf-8")
+        buffer.seek(0)
+        buffer.truncate()
+        return chunk
+
+    writer.writerow(columns)
+    yield drain()
+    for page in pages:
+        writer.writerows(page)
+        yield drain()